@@ -15,67 +15,25 @@
 
 
 import logging
+import hashlib
 import textwrap
-from random import randrange
+from functools import lru_cache
+from random import Random
 from PIL import Image, ImageDraw, ImageFont, ImageOps, ImageColor
 from pathlib import Path
 
 try:
     from . import constants
+    from .Validate import strict_enforce, permissive_enforce
 except ImportError as e:
     import constants
+    from Validate import strict_enforce, permissive_enforce
 
 
 logger = logging.getLogger(__name__)
 # logger.root.setLevel('DEBUG')
 
 
-def strict_enforce(*types):
-    """strictly enforce type compliance within classes
-    
-    Usage:
-    @strict_enforce(type1, type2, (type4A, type4B))
-    def foo(val1, val2, val4):
-        ...
-    """
-    def decorator(f):
-        def new_f(self, *args, **kwds):
-            #we need to convert args into something mutable   
-            newargs = []        
-            for (a, t) in zip(args, types):
-                if not isinstance(a, t):
-                    raise TypeError(f'"{a}" is not type {t}')
-#                 newargs.append( t(a)) #feel free to have more elaborated convertion
-            return f(self, *args, **kwds)
-        return new_f
-    return decorator
-
-
-
-def permissive_enforce(*types):
-    """decorator to enforce type compliance within classes
-    
-    Allows similar types:
-        for int: 0, 0.1
-        for bool: 0, 1, 'some string', False, True
-        for string: 7, 66, '77', 'some string', False, True
-    
-    Usage:
-    @permissive_enforce(type1, type2, typeN)
-    def foo(self, val1, val2, valN):
-        ...
-    """
-    def decorator(f):
-        def new_f(self, *args, **kwds):
-            #we need to convert args into something mutable   
-            newargs = []        
-            for (a, t) in zip(args, types):
-                newargs.append( t(a)) #feel free to have more elaborated convertion
-            return f(self, *newargs, **kwds)
-        return new_f
-    return decorator
-
-
 def add_border(img, fill, width, outline=None, outline_width=1, sides=None):
     '''add a border around an image
     
@@ -119,16 +77,353 @@ def add_border(img, fill, width, outline=None, outline_width=1, sides=None):
     return img
 
 
+@lru_cache(maxsize=constants.FONT_CACHE_SIZE)
+def _truetype(font_path, size):
+    '''load a TTF font face; cached by `get_font`'''
+    logging.debug(f'loading font: {font_path} at size {size}')
+    return ImageFont.truetype(font_path, size=size)
+
+
+def get_font(font, size):
+    '''return a (cached) `ImageFont.truetype` object for a font face and size
+    
+    Fonts are shared between all TextBlock and Layout objects in a process and are
+    keyed on the resolved path of the font file and the size. The least recently used
+    fonts are evicted once `constants.FONT_CACHE_SIZE` fonts are cached.
+    
+    Args:
+        font(str or Path): path to TTF font file
+        size(int): font size in points
+        
+    Returns:
+        ImageFont.FreeTypeFont'''
+    return _truetype(str(Path(font).resolve()), size)
+
+
+def font_cache_info():
+    '''return hits, misses, maxsize and currsize of the font cache as a named tuple'''
+    return _truetype.cache_info()
+
+
+def clear_font_cache():
+    '''empty the font, glyph width, text fitting and text caches and reset the hit/miss counters'''
+    logging.debug('clearing font cache')
+    _truetype.cache_clear()
+    _glyph_table.cache_clear()
+    _measured_lines.cache_clear()
+    _fit_font_size.cache_clear()
+    _wrapped_text.cache_clear()
+    _text_image.cache_clear()
+
+
+@lru_cache(maxsize=constants.FONT_CACHE_SIZE)
+def _glyph_table(font_path, size):
+    '''empty advance width table for a font face and size; filled by `glyph_widths`'''
+    return {}
+
+
+def glyph_widths(font, size, chars):
+    '''return the advance widths in pixels of characters in a font face and size
+    
+    Widths are measured once per font, size and character and shared between all
+    TextBlock and Layout objects in a process.
+    
+    Args:
+        font(str or Path): path to TTF font file
+        size(int): font size in points
+        chars(iterable of str): characters to measure
+        
+    Returns:
+        dict: {char: width}'''
+    font_path = str(Path(font).resolve())
+    table = _glyph_table(font_path, size)
+    missing = [c for c in chars if c not in table]
+    if missing:
+        face = _truetype(font_path, size)
+        for char in missing:
+            table[char] = face.getlength(char)
+    return {c: table[c] for c in chars}
+
+
+def average_char_width(font, size, chardist, samples=2000):
+    '''return the average advance width of a character in a font face and size weighted 
+    by a character distribution
+    
+    Each character is weighted by `int(frequency * samples)`.
+    
+    Args:
+        font(str or Path): path to TTF font file
+        size(int): font size in points
+        chardist(dict): {char: frequency}
+        samples(int): size of the sample the frequencies are scaled to
+        
+    Returns:
+        float: width in pixels'''
+    counts = {c: int(f*samples) for c, f in chardist.items() if int(f*samples) > 0}
+    widths = glyph_widths(font, size, counts)
+    return sum(widths[c]*n for c, n in counts.items())/sum(counts.values())
+
+
+def _text_length(table, face, text):
+    '''width of `text` from the glyph advance table without kerning'''
+    try:
+        return sum(table[c] for c in text)
+    except KeyError:
+        for c in text:
+            if c not in table:
+                table[c] = face.getlength(c)
+        return sum(table[c] for c in text)
+
+
+def _split_word(table, face, word, width):
+    '''split a word that is wider than `width` into pieces that fit'''
+    pieces = []
+    piece = ''
+    for char in word:
+        if piece and face.getlength(piece + char) > width:
+            pieces.append(piece)
+            piece = ''
+        piece += char
+    pieces.append(piece)
+    return pieces
+
+
+@lru_cache(maxsize=constants.TEXT_FIT_CACHE_SIZE)
+def _measured_lines(text, font_path, size, width, max_lines, placeholder):
+    face = _truetype(font_path, size)
+    table = _glyph_table(font_path, size)
+    space = _text_length(table, face, ' ')
+    # kerning can make a line up to this much narrower than the sum of its advances
+    slack = size/2
+
+    words = []
+    for word in text.split():
+        if _text_length(table, face, word) > width:
+            words.extend(_split_word(table, face, word, width))
+        else:
+            words.append(word)
+
+    lines = []
+    line = []
+    line_width = 0
+    for word in words:
+        word_width = _text_length(table, face, word)
+        if not line:
+            line, line_width = [word], word_width
+            continue
+        candidate = line_width + space + word_width
+        if candidate <= width or (candidate - slack <= width
+                                  and face.getlength(' '.join(line + [word])) <= width):
+            line.append(word)
+            line_width = candidate
+        else:
+            lines.append(line)
+            line, line_width = [word], word_width
+    if line:
+        lines.append(line)
+
+    # check each line with kerning applied; move words that do not fit to the next line
+    checked = []
+    while lines:
+        line = lines.pop(0)
+        while len(line) > 1 and face.getlength(' '.join(line)) > width:
+            if lines:
+                lines[0].insert(0, line.pop())
+            else:
+                lines.append([line.pop()])
+        checked.append(line)
+
+    if len(checked) > max_lines:
+        last = checked[max_lines-1]
+        checked = checked[:max_lines]
+        while last and face.getlength(' '.join(last) + placeholder) > width:
+            last.pop()
+        if last:
+            last[-1] += placeholder
+        else:
+            last.append(placeholder)
+    return tuple(' '.join(line) for line in checked)
+
+
+def measured_lines(text, font, size, width, max_lines=None, placeholder='…'):
+    '''wrap text into lines that are no wider than `width` pixels
+    
+    Line widths are estimated from the cached glyph advance widths (see `glyph_widths`) 
+    and checked with `getlength()` so kerning is taken into account. Words that are wider
+    than `width` are broken between characters. Text that does not fit in `max_lines` is 
+    truncated and ends with `placeholder`. Whitespace is collapsed as with `textwrap`.
+    
+    Results are cached on text, font, size, width and max_lines; the cache size is set by 
+    `constants.TEXT_FIT_CACHE_SIZE`.
+    
+    Args:
+        text(str): text to wrap
+        font(str or Path): path to TTF font file
+        size(int): font size in points
+        width(int): maximum line width in pixels
+        max_lines(int): maximum number of lines; None for no limit
+        placeholder(str): appended to the last line when the text is truncated
+        
+    Returns:
+        tuple of str: lines'''
+    return _measured_lines(text, str(Path(font).resolve()), size, width, 
+                           max_lines or len(text) + 1, placeholder)
+
+
+def _lines_height(face, lines, align='left'):
+    '''rendered height in pixels of lines of text as drawn by `TextBlock`'''
+    draw = ImageDraw.Draw(Image.new('1', (1, 1)))
+    return int(draw.multiline_textbbox((0, 0), text='\n'.join(lines), font=face, 
+                                       align=align, anchor='ld')[1] * -1)
+
+
+@lru_cache(maxsize=constants.TEXT_FIT_CACHE_SIZE)
+def _fit_font_size(text, font_path, max_size, width, height, max_lines, min_size):
+    def fits(size):
+        lines = _measured_lines(text, font_path, size, width, max_lines, '')
+        if len(' '.join(lines).split()) != len(text.split()):
+            # words were truncated or broken between characters
+            return False
+        return _lines_height(_truetype(font_path, size), lines) <= height
+
+    if fits(max_size):
+        return max_size
+    low, high = min_size, max_size
+    while high - low > 1:
+        mid = (low + high)//2
+        if fits(mid):
+            low = mid
+        else:
+            high = mid
+    return low
+
+
+def fit_font_size(text, font, max_size, area, max_lines=None, min_size=1):
+    '''return the largest font size at which `text` fits in `area` without truncation
+    
+    The text is wrapped with `measured_lines`; a size fits when every word is kept whole
+    within `max_lines` and the rendered lines are no taller than the area. Sizes are 
+    found with a binary search between `min_size` and `max_size`. `min_size` is returned
+    when nothing fits. Results are cached.
+    
+    Args:
+        text(str): text to fit
+        font(str or Path): path to TTF font file
+        max_size(int): largest font size to try
+        area(tuple of int): width, height in pixels
+        max_lines(int): maximum number of lines; None for no limit
+        min_size(int): smallest font size to try
+        
+    Returns:
+        int: font size'''
+    return _fit_font_size(text, str(Path(font).resolve()), max_size, area[0], area[1], 
+                          max_lines or len(text) + 1, min_size)
+
+
+def text_fit_cache_info():
+    '''return hits, misses, maxsize and currsize of the measured line cache as a named tuple'''
+    return _measured_lines.cache_info()
+
+
+@lru_cache(maxsize=constants.TEXT_WRAP_CACHE_SIZE)
+def _wrapped_text(text, maxchar, max_lines):
+    '''`textwrap.fill` text; shared by all TextBlocks that wrap with the same parameters'''
+    return textwrap.fill(text, width=maxchar, max_lines=max_lines, placeholder='…')
+
+
+@lru_cache(maxsize=constants.TEXT_IMAGE_CACHE_SIZE)
+def _text_image(text, font_path, size, fill, bkground, mode, align):
+    '''render formatted text into an image cropped to the text
+    
+    Images are shared by all TextBlocks that render the same text with the same
+    parameters and must not be modified.
+    
+    Returns:
+        (PIL.Image, tuple of int): text image and its size'''
+    font = get_font(font_path, size)
+    # scratch image for measuring text 
+    draw = ImageDraw.Draw(Image.new(mode=mode, size=(1, 1), color=bkground))
+    
+    # height offset from top of character to top of bounding box 
+    y_offset = draw.textbbox((0, 0), text=text, font=font, align=align)[1] * -1
+
+    # text_mlbbox[1]*-1 is the total height from assent to decender (anchor with ld -- left decender
+    # text_mlbbox[2] is the total x length
+    text_mlbbox = draw.multiline_textbbox((0, 0), text=text, font=font, align=align, anchor='ld')
+    textsize = (int(text_mlbbox[2]), int(text_mlbbox[1]*-1))
+    
+    # create a new image based on textsize
+    text_image = Image.new(mode=mode, size=textsize, color=bkground)
+    draw = ImageDraw.Draw(text_image)
+    draw.multiline_text((0, y_offset), text=text, font=font, align=align, fill=fill)
+    return text_image, textsize
+
+
+def text_cache_info():
+    '''return the hits, misses, maxsize and currsize of the text caches
+    
+    Returns:
+        dict: {'wrap': named tuple, 'image': named tuple} for the word-wrapped text and
+            rendered text image caches'''
+    return {'wrap': _wrapped_text.cache_info(), 'image': _text_image.cache_info()}
+
 
 class BlockError(Exception):
     '''General error class for Blocks'''
     pass
 
 
+class Geometry:
+    '''compact, read-only record of the size and position of a block
+    
+    `Layout` calculates one record per block and passes it to the block as the
+    `geometry` argument; blocks read `area`, `padding`, `padded_area` and 
+    `abs_coordinates` from their record. Padded area and paste box are calculated once.
+    
+    Attributes:
+        area(tuple of int): width, height in pixels
+        padding(int): pixels to pad around the contents
+        padded_area(tuple of int): area less padding
+        abs_coordinates(tuple of int): x, y position of the block within a layout
+        box(tuple of int): (x0, y0, x1, y1) of the area within a layout'''
+    __slots__ = ('area', 'padding', 'padded_area', 'abs_coordinates', 'box')
+    
+    def __init__(self, area, padding=0, abs_coordinates=(0, 0)):
+        width, height = area
+        x, y = abs_coordinates
+        setattr = object.__setattr__
+        setattr(self, 'area', (width, height))
+        setattr(self, 'padding', padding)
+        setattr(self, 'padded_area', (width - 2*padding, height - 2*padding))
+        setattr(self, 'abs_coordinates', (x, y))
+        setattr(self, 'box', (x, y, x + width, y + height))
+        
+    def __setattr__(self, name, value):
+        raise AttributeError('Geometry records are read-only; use `moved()` or create a new record')
+    
+    def __eq__(self, other):
+        if not isinstance(other, Geometry):
+            return NotImplemented
+        return (self.area, self.padding, self.abs_coordinates) == (other.area, other.padding, other.abs_coordinates)
+    
+    def __hash__(self):
+        return hash((self.area, self.padding, self.abs_coordinates))
+    
+    def __repr__(self):
+        return f'Geometry(area={self.area}, padding={self.padding}, abs_coordinates={self.abs_coordinates})'
+    
+    def __reduce__(self):
+        return (Geometry, (self.area, self.padding, self.abs_coordinates))
+    
+    def moved(self, abs_coordinates):
+        '''return a record with the same area and padding at `abs_coordinates`'''
+        return Geometry(self.area, self.padding, abs_coordinates)
+
+
 class Block:
     def __init__(self, area, hcenter=False, vcenter=False, rand=False, inverse=False,
                 abs_coordinates=None, padding=0, fill=None, bkground=None, mode=None, 
-                border_config=None, pillow_palette=False, **kwargs):
+                border_config=None, pillow_palette=False, seed=None, geometry=None, **kwargs):
         '''Create a Block object
         
         Parent class for other types of blocks
@@ -150,10 +445,14 @@ class Block:
                 see help(add_border)
             pillow_palette(bool): False: use waveshare Color Names (constants.COLORS_7_WS)
                 True: use the pillow color pallet for Color Names (HTML colors)
+            seed(int/str): seed for the random number generator used for `rand` placement [None]
+            geometry(Geometry): area, padding and abs_coordinates calculated by a Layout;
+                overrides `area`, `padding` and `abs_coordinates` [None]
             
         Properties:
             image: None - overridden in child classes
-            padded_area(tuple): area less padding to form padded border around block'''
+            padded_area(tuple): area less padding to form padded border around block
+            geometry(Geometry): area, padding and position of the block'''
         
         if abs_coordinates is None:
             abs_coordinates = (0, 0)
@@ -176,13 +475,19 @@ class Block:
         self.bkground = bkground
         self.border_config = border_config
         self.fill = fill
-        self.area = area
-        self.padding = padding
+        if geometry is None:
+            self.area = area
+            self.padding = padding
+            self.abs_coordinates = abs_coordinates
+        else:
+            # share the record calculated by the layout
+            self._geometry = geometry
         self.hcenter = hcenter
         self.vcenter = vcenter
         self.rand = rand
         self.inverse = inverse
-        self.abs_coordinates = abs_coordinates
+        self._random = Random(seed)
+        self._rendered_key = None
         image = None
         logging.debug('creating Block')
 #         if self.fill == self.bkground:
@@ -291,11 +596,11 @@ class Block:
     
     @property
     def area(self):
-        '''tuple/list of int: total area of block: tuple/list of integer
+        '''tuple of int: total area of block
         
         Raises:
             ValueError (non integers)'''
-        return self._area
+        return self._geometry.area
     
     @area.setter
     @strict_enforce((tuple, list))
@@ -307,8 +612,12 @@ class Block:
             if not isinstance(i, int) or i < 1:
                 raise ValueError(f'area must be integer values greater than 0: {area}')
                 
-        self._area = area
-        logging.debug(f'block area: {self._area}')
+        geometry = getattr(self, '_geometry', None)
+        if geometry is None:
+            self._geometry = Geometry(area)
+        else:
+            self._geometry = Geometry(area, geometry.padding, geometry.abs_coordinates)
+        logging.debug(f'block area: {self.area}')
                 
     
     @property
@@ -320,7 +629,7 @@ class Block:
         
         Raises:
             ValueError(non integers)'''
-        return self._padding
+        return self._geometry.padding
     
     @padding.setter
     @strict_enforce(int)
@@ -332,14 +641,20 @@ class Block:
             if padding >= i/2:
                 logging.warning(f'padding value is greater >= 1/2 of area dimension {i}, no image will be displayed: {padding}')
         
-        self._padding = padding
-        self.padded_area = [self.area[0]-2*self.padding, self.area[1]-2*self.padding]
+        geometry = self._geometry
+        if padding != geometry.padding:
+            self._geometry = Geometry(geometry.area, padding, geometry.abs_coordinates)
         
         logging.debug(f'padded area: {self.padded_area}')
         if self.padded_area[0] < .25* self.area[0] or self.padded_area[1] < .25*self.area[1]:
             logging.warning(f'the padded area available may be too small to display any content: Area: {self.area}, Padded Area: {self.padded_area}')
     
         
+    @property
+    def padded_area(self):
+        '''tuple of int: area less padding'''
+        return self._geometry.padded_area
+        
     @property
     def hcenter(self):
         '''bool: horizontally center when true'''
@@ -388,7 +703,8 @@ class Block:
     
     @property
     def abs_coordinates(self):
-        return self._abs_coordinates
+        '''tuple of int: x, y position of the block within a layout'''
+        return self._geometry.abs_coordinates
     
     @abs_coordinates.setter
     @strict_enforce((tuple, list))
@@ -396,8 +712,25 @@ class Block:
         if len(abs_coordinates) > 2:
             raise ValueError(f'area should be a list-like object with length 2: {abs_coordinates}')
                 
-        self._abs_coordinates = abs_coordinates
+        geometry = self._geometry
+        if tuple(abs_coordinates) != geometry.abs_coordinates:
+            self._geometry = geometry.moved(abs_coordinates)
+    
+    @property
+    def geometry(self):
+        '''Geometry: read-only record of `area`, `padding`, `padded_area` and `abs_coordinates`'''
+        return self._geometry
         
+    def _base_render_key(self):
+        '''tuple of the base properties that affect the rendered image'''
+        return (self.mode, tuple(self.area), self.padding, self.fill, self.bkground,
+                self.hcenter, self.vcenter, self.inverse, repr(self.border_config))
+    
+    def _is_rendered(self, key):
+        '''True if the current image was rendered from `key`; blocks using `rand` placement 
+        are never considered rendered so they are placed again on every update'''
+        return not self.rand and key is not None and key == self._rendered_key
+    
     def update(self, *args, **kwargs):
         '''method for updating content of block
         
@@ -450,6 +783,7 @@ class DrawBlock(Block):
         self.draw_format = draw_format
         if self.draw_format and self.shape:
             self.draw_image()
+            self._rendered_key = self._render_key()
         else:
             logging.debug('incomplete init, will not draw image')
 
@@ -612,9 +946,15 @@ class DrawBlock(Block):
         else:
             print('No drawing function selected')
     
+    def _render_key(self):
+        '''tuple of all properties that affect the drawn image'''
+        return self._base_render_key() + (self.shape, repr(self.draw_format), self.abs_x, self.abs_y, 
+                                          self.scale_x, self.scale_y, self.halign, self.valign, self.no_clip)
+
     def draw_image(self):
         '''update the image using the selected drawing function and "draw_format"'''
         logging.debug('drawing image')
+        self._rendered_key = None
         self.image = None
         self.shape = self.shape
                       
@@ -684,7 +1024,8 @@ class DrawBlock(Block):
         """Update image property
         
         DrawBlocks that re fully init'ed with a shape and format are automatcially updated. DrawBlocks
-        do not need to be updated again unless the properties are updated.
+        do not need to be updated again unless the properties are updated. The image is not 
+        redrawn if none of the properties changed since it was last drawn.
 
         Args:
             update(bool): when True redraw image
@@ -692,7 +1033,13 @@ class DrawBlock(Block):
         Returns:
             :obj:bool - true for successful update"""
         if update:
+            key = self._render_key()
+            if self._is_rendered(key):
+                logging.debug('drawing properties are unchanged; skipping redraw')
+                return True
             self.draw_image()
+            self._rendered_key = key
+            return True
 
 
 class TextBlock(Block):
@@ -734,7 +1081,7 @@ class TextBlock(Block):
         upate (method): update contents of ImageBlock"""                    
     def __init__(self, area, font, *args, text=None, font_size=0, 
                  chardist=None, max_lines=1, maxchar=None, align=None, 
-                 textwrap=True, **kwargs):
+                 textwrap=True, measure=False, auto_shrink=False, min_font_size=1, **kwargs):
         """Intializes TextBlock object
         
         Args:
@@ -751,9 +1098,16 @@ class TextBlock(Block):
             align (str, optional): 'left', 'right', 'center' justify text (default: left)
             textwrap(bool): wrap text when true, attempt no wrapping when false
                 when false, max_lines will be ignored making text on exactly one line
+            measure(bool): wrap text on the measured pixel width of each line instead 
+                of `maxchar` (see `measured_lines`)
+            auto_shrink(bool): render text at the largest font size up to `font_size` 
+                at which the text fits the padded area in `max_lines` (implies measure)
+            min_font_size(int): smallest font size used by auto_shrink
         
         Properties:
             text_formatted('str'): text with line breaks according to maxchar and max_lines
+            text_font(ImageFont.FreeTypeFont): font used to render text; differs from 
+                `font` when auto_shrink reduced the font size
             image(PIL:Image): text rendered as an image
             
             """        
@@ -767,6 +1121,9 @@ class TextBlock(Block):
     
         self.align = align
         self.textwrap = textwrap
+        self.measure = measure
+        self.auto_shrink = auto_shrink
+        self.min_font_size = min_font_size
         self.font_size = font_size
         self.chardist = chardist
         self.maxchar = maxchar
@@ -826,7 +1183,7 @@ class TextBlock(Block):
     @strict_enforce((Path, str))
     def font(self, font):
         self._font_path = str(Path(font))
-        self._font = ImageFont.truetype(str(Path(font).resolve()), size=self.font_size)
+        self._font = get_font(font, self.font_size)
         # trigger a calculation of maxchar if not already set
         if not self.maxchar:
             self.maxchar = self._calc_maxchar()
@@ -882,28 +1239,45 @@ class TextBlock(Block):
         return self._text
     
     @text.setter
-    @permissive_enforce(str)
     def text(self, text):
+        self._rendered_key = None
+        # convert in place of `permissive_enforce(str)`; text is set on every update
+        if text.__class__ is not str:
+            text = str(text)
         if text:
             self._text = text
 
         self.text_formatted = self._text_formatter()
         self.image = self._text2image()
 
+    def _render_key(self, text):
+        '''tuple of `text` and all properties that affect the rendered text image'''
+        return self._base_render_key() + (text, self._font_path, self.font_size, self.maxchar, 
+                                          self.max_lines, self.textwrap, self.align, 
+                                          self.measure, self.auto_shrink, self.min_font_size)
+
     def update(self, update=None):
         """Update image data including coordinates (overrides base class)
         
+        The text is not re-rendered if it is identical to the current text and none of the
+        properties changed since it was last rendered.
+        
         Args:
             update (str): text to format and use
             
         Returns:
             :obj:bool - true for successful update"""
         if update:
+            key = self._render_key(str(update))
+            if self._is_rendered(key):
+                logging.debug('text is unchanged; skipping render')
+                return True
             try:
                 self.text = update
             except Exception as e:
                 logging.error(f'failed to update: {e}')
                 return False
+            self._rendered_key = key
             return True        
 
     def _calc_maxchar(self):
@@ -915,18 +1289,10 @@ class TextBlock(Block):
             :obj:int: characters per line"""
         if not self.font:
             raise AttributeError('no font is set - cannot calculate maximum characters per line')
-        logging.debug(f'calculating maximum characters for font {self.font.getname()} at size {self.font_size}')
-        
-        # holder for strings
-        s = ''
-        # max number of characters to sample from the character distribution
-        n = 2000
-        # create a random string of characters containing the letter distribution
-        for char in self.chardist:
-            s = s+(char*int(self.chardist[char]*n))
-        s_length = self.font.getbbox(s)[2] # string length in Pixles
-        # find average width of each character
-        avg_width = s_length/len(s)
+        logging.debug(f'calculating maximum characters for font {self._font_path} at size {self.font_size}')
+        
+        # average advance width of the character distribution from the glyph width table
+        avg_width = average_char_width(self._font_path, self.font_size, self.chardist)
         logging.debug(f'calculated average character width: {avg_width}')
         maxchar = round(self.padded_area[0]/avg_width)
         self._maxchar = maxchar
@@ -947,13 +1313,21 @@ class TextBlock(Block):
         Returns:
             :obj:`list` of :obj:`str`"""        
         logging.debug(f'formatting string: {self.text}')
-
-        if self.textwrap:
+        self.text_font = self.font
+
+        if self.textwrap and (self.measure or self.auto_shrink):
+            width = self.padded_area[0]
+            size = self.font_size
+            if self.auto_shrink:
+                size = fit_font_size(self.text, self._font_path, self.font_size, self.padded_area, 
+                                     max_lines=self.max_lines, min_size=min(self.min_font_size, size))
+                logging.debug(f'auto_shrink font size: {size}')
+                self.text_font = get_font(self._font_path, size)
+            formatted = '\n'.join(measured_lines(self.text, self._font_path, size, width, 
+                                                 max_lines=self.max_lines))
+        elif self.textwrap:
             try:
-                formatted = textwrap.fill(self.text, 
-                                          width=self.maxchar, 
-                                          max_lines=self.max_lines, 
-                                          placeholder='…')
+                formatted = _wrapped_text(self.text, self.maxchar, self.max_lines)
             except (TypeError, ValueError) as e:
                 logging.critical(f'it is not possible to wrap text into this area with the current font settings; returning an empty string: {e}')
                 formatted = ''
@@ -969,43 +1343,14 @@ class TextBlock(Block):
         Returns:
             (PIL.Image, tuple of bounding box) """
 
-        # max area for rendering text
-        # text_image = Image.new(mode=self.mode, size=self.padded_area, color=self.bkground)
-        # scratch image for measuring text 
-        scratch_image = Image.new(mode=self.mode, size=(1, 1), color=self.bkground)
-        draw = ImageDraw.Draw(scratch_image)
-        
-        # height offset from top of character to top of bounding box 
-        y_offset = draw.textbbox((0, 0), 
-                                 text=self.text_formatted, 
-                                 font=self.font, 
-                                 align=self.align)[1] * -1
-
-        # text_mlbbox[1]*-1 is the total height from assent to decender (anchor with ld -- left decender
-        # text_mlbbox[2] is the total x length
-        text_mlbbox = draw.multiline_textbbox((0, 0), 
-                                              text=self.text_formatted, 
-                                              font=self.font, 
-                                              align=self.align, 
-                                              anchor='ld')
-        
-        textsize = (int(text_mlbbox[2]), int(text_mlbbox[1]*-1))
+        # rendered text is cached; rotating displays render the same strings repeatedly
+        text_image, textsize = _text_image(self.text_formatted, self.text_font.path, self.text_font.size,
+                                           self.fill, self.bkground, self.mode, self.align)
         logging.debug(f'text size: {textsize}')        
         
-        
         if textsize[0] > self.padded_area[0] or textsize[1] > self.padded_area[1]:
             logging.info('the text will spill outside of padded area using these values')
         
-        # create a new image based on textsize
-        text_image = Image.new(mode=self.mode, size=textsize, color=self.bkground)
-        draw = ImageDraw.Draw(text_image)
-        draw.multiline_text((0, y_offset), 
-                                text=self.text_formatted, 
-                                font=self.font, 
-                                align=self.align,
-                                fill=self.fill)        
-    
-        
         paste_x = self.padding
         paste_y = self.padding
         if self.rand:
@@ -1014,12 +1359,12 @@ class TextBlock(Block):
             y_max = self.padded_area[1] - textsize[1]
             
             try:
-                paste_x = randrange(0, x_max, 1) + self.padding
+                paste_x = self._random.randrange(0, x_max, 1) + self.padding
             except ValueError:
                 logging.info('text image is too large for random placement in x dimension')
                 x_max = self.padding
             try:
-                paste_y = randrange(0, y_max, 1) + self.padding
+                paste_y = self._random.randrange(0, y_max, 1) + self.padding
             except ValueError:
                 logging.info('text image is too large for random placement in y dimension')
                 y_max = self.padding
@@ -1098,9 +1443,9 @@ class ImageBlock(Block):
         
         super().__init__(area, *args, **kwargs)
         
-        
-        self.image = image
+        # the image setter reads `remove_alpha`
         self.remove_alpha = remove_alpha
+        self.image = image
         
     @staticmethod
     def remove_transparency(im, bg_colour=None):
@@ -1143,7 +1488,7 @@ class ImageBlock(Block):
     
     @image.setter
     def image(self, image):
-
+        self._rendered_key = None
         image_area = Image.new(self.mode, self.area, self.bkground)
         logging.debug(f'image area (max): {image_area.size}')
         paste_x = self.padding
@@ -1180,6 +1525,9 @@ class ImageBlock(Block):
             
             if thumbnail:
                 logging.debug(f'resizing image to: {self.padded_area}')
+                # `thumbnail()` resizes in place; leave the image that was passed unchanged
+                if im is image:
+                    im = im.copy()
                 im.thumbnail(self.padded_area, Image.BICUBIC)
             
         
@@ -1211,12 +1559,12 @@ class ImageBlock(Block):
 
                 # choose random placement
                 try:
-                    paste_x = randrange(self.padding, x_range-self.padding, 1)
+                    paste_x = self._random.randrange(self.padding, x_range-self.padding, 1)
                 except ValueError as e:
                     logging.info('x image dimension is too large for random placement')
                 
                 try:
-                    paste_y = randrange(self.padding, y_range-self.padding, 1)  
+                    paste_y = self._random.randrange(self.padding, y_range-self.padding, 1)  
                 except ValueError as e:
                     logging.info('y image dimension is too large for random placement')
 
@@ -1228,20 +1576,57 @@ class ImageBlock(Block):
             
             self._image = image_area
     
+    @staticmethod
+    def _image_signature(image):
+        '''return a signature identifying the contents of an image source
+        
+        Args:
+            image(PIL.Image, pathlib.Path or str): image or path to image file
+            
+        Returns:
+            tuple: resolved path, modification time and size for files; mode, size and 
+                md5 hash of the pixel data for PIL images; None if the source cannot be identified'''
+        if isinstance(image, (str, Path)):
+            try:
+                path = Path(image).resolve()
+                stat = path.stat()
+            except OSError:
+                return None
+            return ('path', str(path), stat.st_mtime_ns, stat.st_size)
+        elif isinstance(image, Image.Image):
+            return ('image', image.mode, image.size, hashlib.md5(image.tobytes()).hexdigest())
+        else:
+            return None
+        
+    def _render_key(self, image):
+        '''tuple of the signature of `image` and all properties that affect the rendered image'''
+        signature = self._image_signature(image)
+        if signature is None:
+            return None
+        return self._base_render_key() + (signature, self.remove_alpha)
+    
     def update(self, update=None):
         """Update image data including coordinates (overrides base class)
         
+        The image is not re-rendered if the file path and modification time, or the pixel
+        data of a PIL image are identical to the current image.
+        
         Args:
             update(PIL or Path): image to use in update
             
         Returns:
             :obj:bool on success"""        
         if update:
+            key = self._render_key(update)
+            if self._is_rendered(key):
+                logging.debug('image is unchanged; skipping render')
+                return True
             try:
                 self.image = update
             except Exception as e:
                 logging.error(f'failed to update due to error: {e}')
                 return False
+            self._rendered_key = key
             return True
         else:
             logging.warn('update called with no arguments, no action taken')
@@ -1249,6 +1634,21 @@ class ImageBlock(Block):
 
 
 
+def render_block(block, update):
+    '''update a block and return its state
+    
+    Used for rendering picklable blocks (e.g. ImageBlock) in worker processes; 
+    apply the returned state to the original block with `block.__dict__.update(state)`
+    
+    Args:
+        block(Block): block to update
+        update: contents passed to `block.update()`
+        
+    Returns:
+        tuple: (dict of block state, result of `block.update()`)'''
+    result = block.update(update)
+    return block.__dict__, result
+
 
 def dir2dict(obj):
     d = {}
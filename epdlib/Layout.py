@@ -21,8 +21,14 @@
 
 
 import logging
+import os
+import re
+import sys
 from pathlib import Path
 import copy
+import hashlib
+import heapq
+import json
 from PIL import Image, ImageDraw, ImageFont
 
 
@@ -33,9 +39,11 @@ from PIL import Image, ImageDraw, ImageFont
 try:
     from . import constants
     from . import version
+    from .Validate import strict_enforce
 except ImportError as e:
     import constants
     import version
+    from Validate import strict_enforce
 
 
 try: 
@@ -51,46 +59,111 @@ except ImportError as e:
 logger = logging.getLogger(__name__)
 
 
+class LayoutError(Exception):
+    '''General error class for Layouts'''
+    pass
 
 
-
-
-def strict_enforce(*types):
-    """strictly enforce type compliance within classes
+class FrozenSection(dict):
+    '''read-only layout section record; copies and pickles like a dict'''
+    def _read_only(self, *args, **kwargs):
+        raise TypeError(f'{type(self).__name__} is read-only')
     
-    Usage:
-        @strict_enforce(type1, type2, (type3, type4))
-        def foo(val1, val2, val3):
-            ...
-    """
-    def decorator(f):
-        def new_f(self, *args, **kwds):
-            #we need to convert args into something mutable   
-            newargs = []        
-            for (a, t) in zip(args, types):
-                if not isinstance(a, t):
-                    raise TypeError(f'"{a}" is not type {t}')
-#                 newargs.append( t(a)) #feel free to have more elaborated convertion
-            return f(self, *args, **kwds)
-        return new_f
-    return decorator
-
-
-
-
+    __setitem__ = __delitem__ = __ior__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+    
+    def __reduce__(self):
+        return (type(self), (dict(self),))
+    
+    def __copy__(self):
+        return self
+    
+    def __deepcopy__(self, memo):
+        return type(self)(copy.deepcopy(dict(self), memo))
 
 
 class Layout:
-    def __init__(self, resolution, layout=None, force_onebit=False, mode=None):
+    def __init__(self, resolution, layout=None, force_onebit=False, mode=None, cache_dir=None,
+                 executor=None, seed=None, transform=None):
         
         if mode is None:
             mode = '1'
         
+        self.transform = transform
+        self.executor = executor
+        self.seed = seed
+        self.cache_dir = cache_dir
         self.resolution = resolution
         self.force_onebit = force_onebit
         self.mode = mode
         self.layout = layout
         
+    @property
+    def executor(self):
+        '''`concurrent.futures.Executor` used for rendering blocks concurrently in `update_contents` 
+        (None: render blocks one at a time)
+        
+        ImageBlocks are rendered in worker threads (`ThreadPoolExecutor`) or worker processes
+        (`ProcessPoolExecutor`); all other blocks are rendered in the calling thread. TextBlocks
+        share `FreeTypeFont` objects through the font cache and these are not safe to use from
+        several threads at once. The executor is not shut down by the Layout.'''
+        return self._executor
+    
+    @executor.setter
+    def executor(self, executor):
+        if executor is not None and not hasattr(executor, 'submit'):
+            raise TypeError(f'"{executor}" is not a concurrent.futures.Executor')
+        self._executor = executor
+        
+    @property
+    def transform(self):
+        '''PIL.Image.Transpose operation applied to blocks when they are pasted by `concat` 
+        (None: no transform)
+        
+        Use `Screen.transform` to render images in panel orientation so `Screen.writeEPD` 
+        does not need to rotate or mirror each frame:
+            layout = Layout(resolution=screen.resolution, layout=l, transform=screen.transform)
+            screen.writeEPD(layout.concat(), transformed=True)'''
+        return self._transform
+    
+    @transform.setter
+    @strict_enforce((Image.Transpose, type(None)))
+    def transform(self, transform):
+        self._transform = transform
+        # the canvas is in the old orientation
+        if getattr(self, 'image', None) is not None:
+            self.image = None
+        
+    @property
+    def seed(self):
+        '''seed for `rand` placement of blocks (None: unseeded)
+        
+        Each block is seeded with "seed:block_name" so placement does not depend on the 
+        order blocks are rendered in. A `seed` key in a layout section overrides this value.'''
+        return self._seed
+    
+    @seed.setter
+    @strict_enforce((int, str, type(None)))
+    def seed(self, seed):
+        self._seed = seed
+
+    @property
+    def cache_dir(self):
+        '''directory used for caching computed layouts between runs (None: disabled)
+        
+        Computed areas, coordinates, font sizes and maxchar values are stored in
+        a json file keyed on a hash of the layout, resolution, mode and font file
+        modification times. When a matching file is found, the font measurement
+        work is skipped.'''
+        return self._cache_dir
+    
+    @cache_dir.setter
+    @strict_enforce((str, Path, type(None)))
+    def cache_dir(self, cache_dir):
+        if cache_dir is not None:
+            cache_dir = Path(cache_dir).expanduser().resolve()
+        self._cache_dir = cache_dir
+        
     @property
     def resolution(self):
         return self._resolution
@@ -106,8 +179,8 @@ class Layout:
         
         # force an update to the layout when the resolution is reset
         try:
-            # deepcopy the master_layout into the layout property and preserve the layout
-            self.layout = copy.deepcopy(self._master_layout)
+            # the frozen master layout is reused; only the geometry is recalculated
+            self.layout = self._master_layout
         except AttributeError:
             pass
         
@@ -120,29 +193,57 @@ class Layout:
     def layout(self, layout):
         '''set the layout property, calculates positions and creates the blocks 
         
+        The layout is copied once into `_master_layout`: each section becomes a read-only
+        record and nested values (`draw_format` dicts, lists, ...) are deep copied. PIL images
+        are shared with the layout that was passed. `layout` holds a plain dict per section 
+        with the defaults, the record and the calculated values; nested values are shared 
+        with the record, change them with `update_block_props`. Blocks receive their own 
+        copies of dict values.
+        
         Sets:
             self.layout
             self.blocks
             '''
-        # deep copy the provided layout into the 
-        self._master_layout = copy.deepcopy(layout)
+        self._master_layout = self._freeze(layout)
         self.blocks = {}
+        self.geometry = {}
+        self._reset_canvas()
 
         
         if self._master_layout:
             self._calculate_layout()
             
+            cache_file = self._cache_file()
+            cached = self._read_cache(cache_file)
+            
             blocks = {}
             logging.debug(f'layout config: resolution, {self.resolution}, force_onebit: {self.force_onebit}, mode: {self.mode}')
             logging.info(f'[[{"SETTING SECTION BLOCKS":_^30}]]')
             for name, values in self.layout.items():
-                blocks[name] = self.set_block(name, values)
+                blocks[name] = self.set_block(name, values, cached=cached.get(name))
             self.blocks = blocks
+            
+            if cache_file and not cached:
+                self._write_cache(cache_file)
         else:
             logging.debug('NO MASTER LAYOUT YET')
 
 
-    def set_block(self, name, values, force_recalc=False):
+    @staticmethod
+    def _copy_values(values):
+        '''deep copy the values of a section; PIL images are shared'''
+        memo = {id(val): val for val in values.values() if isinstance(val, Image.Image)}
+        return copy.deepcopy(dict(values), memo)
+    
+    @classmethod
+    def _freeze(cls, layout):
+        '''return a layout with each section as a read-only record; existing records are shared'''
+        if layout is None:
+            return None
+        return {name: values if isinstance(values, FrozenSection) else FrozenSection(cls._copy_values(values))
+                for name, values in layout.items()}
+    
+    def set_block(self, name, values, force_recalc=False, cached=None):
         '''create a block object using values
         
         Allows recalculating all blocks; this is useful if the area, resolution,
@@ -151,7 +252,9 @@ class Layout:
         Args:
             name(str): reference name for block
             values(dict): settings for block
-            force_recalc(bool): force recalculation of all the blocks'''
+            force_recalc(bool): force recalculation of all the blocks
+            cached(dict): precomputed `font_size` and `maxchar` for this block from
+                the layout cache'''
         logging.info(f'setting section: [{name:_^30}]')
         
         
@@ -160,7 +263,11 @@ class Layout:
             
         # scale the selected font face size into the available area/lines
         if values['type'] == 'TextBlock':
-            values['font_size'] = self._scale_font(values)        
+            if cached:
+                logging.debug(f'using cached font_size: {cached["font_size"]}, maxchar: {cached["maxchar"]}')
+                values['font_size'] = cached['font_size']
+            else:
+                values['font_size'] = self._scale_font(values)        
         
         values['mode'] = values.get('mode', self.mode)
         
@@ -170,30 +277,167 @@ class Layout:
         if self.force_onebit:
             values['mode'] = '1'
             logging.debug('forcing block to 1 bit mode')
-            
+        
+        # blocks add defaults to dict values such as `draw_format`; keep the layout unchanged
+        block_kwargs = {key: dict(val) if isinstance(val, dict) else val 
+                        for key, val in values.items()}
+        
+        # use the calculated geometry unless `values` places the block elsewhere
+        geometry = getattr(self, 'geometry', {}).get(name)
+        if geometry is None or (geometry.area, geometry.padding, geometry.abs_coordinates) != (
+                tuple(values['area']), values.get('padding', 0), tuple(values.get('abs_coordinates') or (0, 0))):
+            geometry = Block.Geometry(values['area'], values.get('padding', 0), 
+                                      values.get('abs_coordinates') or (0, 0))
+        block_kwargs['geometry'] = geometry
+        if cached and values['type'] == 'TextBlock' and not values.get('maxchar'):
+            block_kwargs['maxchar'] = cached['maxchar']
+        if self.seed is not None and 'seed' not in block_kwargs:
+            block_kwargs['seed'] = f'{self.seed}:{name}'
 
         logging.debug(f'setting block type: {values["type"]}')
         try:
-            block = getattr(Block, values['type'])(**values)
+            block = getattr(Block, values['type'])(**block_kwargs)
 
         except AttributeError:
-            raise AttributeError(f'module "Block" has no attribute {values["type"]}. error in section: {section}')
+            raise AttributeError(f'module "Block" has no attribute {values["type"]}. error in section: {name}')
         
         if block.border_config.get('sides', False):
             block.border_config['fill'] = block.fill
         
         return block
 
-    def _add_defaults(self):
-        '''check that layout contains the minimum default values '''
+    def _cache_file(self):
+        '''return the path to the cache file for the current layout configuration
+        
+        The file name is a hash of the master layout, resolution, mode, force_onebit,
+        epdlib version and the modification times of all font files used in the layout.
+        
+        Returns:
+            Path or None if caching is disabled'''
+        if not self.cache_dir:
+            return None
+        
+        font_mtimes = {}
+        for section, values in self.layout.items():
+            font = values.get('font')
+            if font:
+                try:
+                    font_mtimes[str(font)] = Path(font).resolve().stat().st_mtime
+                except OSError:
+                    font_mtimes[str(font)] = None
+                    
+        key = json.dumps({'layout': {name: dict(values) for name, values in self._master_layout.items()},
+                          'resolution': list(self.resolution),
+                          'mode': self.mode,
+                          'force_onebit': self.force_onebit,
+                          'fonts': font_mtimes,
+                          'version': version.__version__}, 
+                         sort_keys=True, default=self._cache_key_value)
+        
+        return self.cache_dir / f'layout_{hashlib.sha1(key.encode()).hexdigest()}.json'
+    
+    @staticmethod
+    def _cache_key_value(value):
+        '''return a JSON value for a layout value that is not a JSON type
+        
+        Images are keyed on their contents. Objects whose repr includes their memory 
+        address would change the key in every process; they are left out of the key.'''
+        if isinstance(value, Image.Image):
+            return ['PIL.Image', value.mode, list(value.size), 
+                    hashlib.blake2b(value.tobytes(), digest_size=16).hexdigest()]
+        if isinstance(value, Path):
+            return str(value)
+        text = repr(value)
+        if re.search(r' at 0x[0-9a-fA-F]+', text):
+            logging.warning(f'layout cache key does not include the value of {type(value).__name__} objects: {text}')
+            return type(value).__qualname__
+        return text
+    
+    def _prune_cache(self, keep=constants.LAYOUT_CACHE_FILES):
+        '''remove all but the `keep` most recently used layout cache files from `cache_dir`'''
         try:
-            if not self._layout:
-                return
-        except AttributeError:
+            files = sorted(self.cache_dir.glob('layout_*.json'), key=lambda f: f.stat().st_mtime, reverse=True)
+        except OSError as e:
+            logging.warning(f'could not list layout cache files in {self.cache_dir}: {e}')
             return
+        for stale in files[keep:]:
+            try:
+                stale.unlink()
+            except OSError as e:
+                logging.warning(f'could not remove layout cache file {stale}: {e}')
+            else:
+                logging.debug(f'removed stale layout cache file: {stale}')
+    
+    def _read_cache(self, cache_file):
+        '''read cached block values if the cache file exists and matches the calculated geometry
+        
+        Args:
+            cache_file(Path): path to cache file
+            
+        Returns:
+            dict: {section: {area, padded_area, abs_coordinates, font_size, maxchar}}'''
+        if not cache_file:
+            return {}
+        
+        try:
+            with open(cache_file, 'r') as f:
+                cached = json.load(f)
+        except FileNotFoundError:
+            logging.debug(f'no layout cache file: {cache_file}')
+            return {}
+        except (OSError, ValueError) as e:
+            logging.warning(f'could not read layout cache file {cache_file}: {e}')
+            return {}
+        
+        # discard the cache if the geometry does not match the calculated geometry
+        for section, values in self.layout.items():
+            record = cached.get(section)
+            if not record:
+                logging.info(f'layout cache is missing section "{section}"; ignoring cache')
+                return {}
+            for key in ('area', 'padded_area', 'abs_coordinates'):
+                if list(values[key]) != list(record[key]):
+                    logging.info(f'layout cache does not match section "{section}"; ignoring cache')
+                    return {}
+        
+        logging.debug(f'using layout cache: {cache_file}')
+        # mark as recently used so it is kept by `_prune_cache`
+        try:
+            os.utime(cache_file)
+        except OSError:
+            pass
+        return cached
+    
+    def _write_cache(self, cache_file):
+        '''write calculated geometry, font sizes and maxchar values for each block to `cache_file`
+        
+        Args:
+            cache_file(Path): path to cache file'''
+        cache = {}
+        for section, values in self.layout.items():
+            cache[section] = {'area': list(values['area']),
+                              'padded_area': list(values['padded_area']),
+                              'abs_coordinates': list(values['abs_coordinates']),
+                              'font_size': values.get('font_size'),
+                              'maxchar': getattr(self.blocks[section], 'maxchar', None)}
+        try:
+            cache_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp_file = cache_file.with_suffix('.tmp')
+            with open(tmp_file, 'w') as f:
+                json.dump(cache, f)
+            tmp_file.replace(cache_file)
+        except OSError as e:
+            logging.warning(f'could not write layout cache file {cache_file}: {e}')
+        else:
+            logging.debug(f'wrote layout cache: {cache_file}')
+            self._prune_cache()
 
+    def _add_defaults(self):
+        '''set `layout` from `_master_layout` with the default values for each block type'''
         logging.debug('[[----checking default values for layout----]')
-        for section, values in self.layout.items():
+        self._layout = {}
+        type_defaults = {}
+        for section, values in self._master_layout.items():
             logging.debug(f'section: [{section:-^30}]')
             
             
@@ -211,78 +455,182 @@ class Layout:
             
             ### add kludge to bridge between 0.5 and 0.6 -- temporarily allow no type and guess 
             
-            for key, default in my_defaults.items():
-                if not key in values:
-                    values[key] = default
-                    logging.debug(f'adding "{key}: {default}"')
+            if my_type not in type_defaults:
+                type_defaults[my_type] = {**constants.LAYOUT_DEFAULTS, **my_defaults}
+            # calculated values are written to this dict; the record is not changed
+            self._layout[section] = {**type_defaults[my_type], **values}
+
             
-            for key, default in constants.LAYOUT_DEFAULTS.items():
-                if not key in values:
-                    values[key] = default
-                    logging.debug(f'adding "{key}: {default}"')
-                    
-            self.layout[section] = values
+    @staticmethod
+    def _references(section, spec):
+        '''names of the other sections that `section` is positioned relative to
+        
+        Args:
+            section(str): name of section
+            spec(Mapping): specification of the section from `_master_layout`'''
+        # calculated positions replace `abs_coordinates`; use the specification
+        abs_coordinates = spec.get('abs_coordinates', constants.LAYOUT_DEFAULTS['abs_coordinates'])
+        if abs_coordinates[0] is not None and abs_coordinates[1] is not None:
+            return []
+        relative = spec.get('relative', constants.LAYOUT_DEFAULTS['relative'])
+        if not isinstance(relative, (tuple, list)):
+            raise KeyError(f'section "{section}" has a missing or malformed "relative" key.')
+        return [val for val in relative if val != section]
+    
+    def _sort_sections(self, master=None):
+        '''topologically sort the sections on their `relative` references
+        
+        Sections are kept in layout order where the references allow it. Nothing is set
+        when the references are missing or form a cycle.
+        
+        Args:
+            master(dict): section specifications to sort (default: `_master_layout`)
+        
+        Sets:
+            _order(list): section names; every section follows the sections it references
+            _dependents(dict): {section: [sections that reference it]}'''
+        if master is None:
+            master = self._master_layout
+        names = list(master)
+        position = {name: index for index, name in enumerate(names)}
+        references = {}
+        dependents = {name: [] for name in names}
+        for section in names:
+            references[section] = set(self._references(section, master[section]))
+            for val in references[section]:
+                if val not in dependents:
+                    raise KeyError(f'bad relative section value: could not locate relative section "{val}"  when processing section "{section}"')
+                dependents[val].append(section)
+        
+        order = []
+        waiting = {section: len(refs) for section, refs in references.items()}
+        ready = [position[section] for section in names if not waiting[section]]
+        while ready:
+            section = names[heapq.heappop(ready)]
+            order.append(section)
+            for dependent in dependents[section]:
+                waiting[dependent] -= 1
+                if not waiting[dependent]:
+                    heapq.heappush(ready, position[dependent])
+        
+        if len(order) < len(names):
+            # follow unresolved references until a section repeats
+            cycle = [next(section for section in names if waiting[section])]
+            while True:
+                section = next(val for val in references[cycle[-1]] if waiting[val])
+                if section in cycle:
+                    cycle = cycle[cycle.index(section):] + [section]
+                    break
+                cycle.append(section)
+            raise LayoutError(f'sections are positioned relative to each other in a cycle: {" -> ".join(cycle)}')
+        
+        self._order = order
+        self._dependents = dependents
+        logging.debug(f'section order: {order}')
+    
+    def _calculate_section(self, section):
+        '''calculate the area, padded area and absolute position of one section from its
+        specification in `_master_layout` and the sections it references
+        
+        Sets:
+            geometry[section]
+        
+        Returns:
+            Block.Geometry'''
+        values = self.layout[section]
+        logging.info(f'section: [{section:.^30}]')
+        
+        # calculate absolute area of each block
+        width, height, padding = values['width'], values['height'], values['padding']
+        logging.debug(f"resolution: {self.resolution}")
+        logging.debug(f"width: {width}, height: {height}")
 
+        area = (round(self.resolution[0]*width), round(self.resolution[1]*height))
+    
+        # calculated positions replace `abs_coordinates`; start from the specification
+        abs_coordinates = self._master_layout[section].get('abs_coordinates', 
+                                                           constants.LAYOUT_DEFAULTS['abs_coordinates'])
+    
+        # calculate absolute position for each block using the relative positions of reference block(s)
+        if abs_coordinates[0] is None or abs_coordinates[1] is None:
+            logging.debug('calculating block position from relative positions')
+            pos = [None, None]
+            
+            for index, val in enumerate(values['relative']):
+                # use the absolute value provided in this section
+                if val == section:
+                    pos[index] = abs_coordinates[index]
+                else:
+                    # calculate position relative to another block
+                    box = self.geometry[val].box
+                    pos[index] = box[index + 2]
+            abs_coordinates = pos
+        else: 
+            logging.debug('absolute coordinates provided')
+        
+        geometry = Block.Geometry(area, padding, abs_coordinates)
+        self.geometry[section] = geometry
+        values['area'] = geometry.area
+        values['padded_area'] = geometry.padded_area
+        values['abs_coordinates'] = geometry.abs_coordinates
+        logging.debug(f'geometry: {geometry}')
+        return geometry
             
     def _calculate_layout(self):
         '''calculate values for each block based on resolution, absolute and relative positions'''
         
         try:
-            # always start with a fresh copy of the `master_layout` and recalculate everything
-            self._layout = copy.deepcopy(self._master_layout)
+            if not self._master_layout:
+                return
         except AttributeError:
             return
+        self.geometry = {}
         
         self._add_defaults()
+        self._sort_sections()
         
         logging.debug('[[....calculating layouts....]]')
-        for section, values in self.layout.items() :
-            logging.info(f'section: [{section:.^30}]')
-            
-            # calculate absolute area and padded area of each block
-            
-            logging.debug(f"resolution: {self.resolution}")
-            logging.debug(f"width: {values['width']}, height: {values['height']}")
-
-            area = (round(self.resolution[0]*values['width']), 
-                    round(self.resolution[1]*values['height']))
-            
-            padded_area = (area[0] - (2* values['padding']),
-                           area[1] - (2* values['padding']))
-        
-            values['area'] = area
-            values['padded_area'] = padded_area
-            logging.debug(f'area: {area}, padded_area: {padded_area}')
+        for section in self._order:
+            self._calculate_section(section)
+    
+    def _relayout(self, section):
+        '''recalculate `section` and the sections positioned relative to it
         
+        Changes propagate through `_dependents` only while the area or position of a 
+        section changes. Blocks whose area changed are rebuilt; blocks that only moved 
+        are moved.
         
-            # calculate absolute position for each block using the relative positions of reference block(s)
-            if values['abs_coordinates'][0] is None or values['abs_coordinates'][1] is None:
-                logging.debug('calculating block position from relative positions')
-                pos = [None, None]
-                
-                if not isinstance(values['relative'], (tuple, list)):
-                    raise KeyError(f'section "{section}" has a missing or malformed "relative" key.')
-                    
-                
-                for index, val in enumerate(values['relative']):
-                    # use the absolute value provided in this section
-                    if val == section:
-                        pos[index] = values['abs_coordinates'][index]
-                    else:
-                        # calculate position relative to another block
-                        try:
-                            pos[index] = self.layout[val]['area'][index] + self.layout[val]['abs_coordinates'][index]
-                        except KeyError:
-                            raise KeyError(f'bad relative section value: could not locate relative section "{val}"  when processing section "{section}"')
-                values['abs_coordinates'] = (pos[0], pos[1])
-            else: 
-                logging.debug('absolute coordinates provided')
+        Returns:
+            list: names of the sections whose blocks were rebuilt or moved'''
+        affected = {section}
+        changed = []
+        for name in self._order:
+            if name not in affected:
+                continue
+            old = self.geometry.get(name)
+            new = self._calculate_section(name)
+            if name != section and new == old:
+                logging.debug(f'section "{name}" is unchanged')
+                continue
             
-            logging.debug(f'block coordinates: {values["abs_coordinates"]}')            
+            affected.update(self._dependents[name])
+            changed.append(name)
+            if name == section or old is None or (new.area, new.padding) != (old.area, old.padding):
+                self.blocks[name] = self.set_block(name, self.layout[name])
+            else:
+                logging.debug(f'moving block "{name}" to {new.abs_coordinates}')
+                self.blocks[name].abs_coordinates = new.abs_coordinates
+            self._dirty.add(name)
+        logging.debug(f'relayout of "{section}" changed sections: {changed}')
+        return changed
     
     @staticmethod
     def _scale_font(this_section):
         '''scale a font face into the avaialble area/max-lines settings
+        
+        The largest font size that fits is found with a bracketed binary search 
+        seeded from a linear estimate: the text is measured once at a size equal 
+        to the line height and scaled to the target area. 
 
         Args:
             this_section(dict): layout section dictionary
@@ -296,65 +644,307 @@ class Layout:
         y_target = y_target/this_section['max_lines']
         font = this_section['font']        
 
-        cont = True
-        fontsize = 0
-        # try different font sizes until an a value that fits within the y_target value is found
-        while cont:
-            fontsize += 1
-            testfont = ImageFont.truetype(font, fontsize)
+        def fits(fontsize):
+            '''True if the text fits within the x and y target at fontsize'''
+            if fontsize < 1:
+                return True
+            fontdim = Block.get_font(font, fontsize).getbbox(text)
+            return fontdim[2] <= x_target and fontdim[3] <= y_target
 
-            fontdim = testfont.getbbox(text)
-
-            if fontdim[2] > x_target:
-                cont = False
-                logging.debug('x target size reached')
-
-            if fontdim[3] > y_target:
-                cont = False
-                logging.debug('y target size reached')
+        # linear estimate from the text dimensions at a reference size
+        ref_size = max(1, int(y_target))
+        ref_dim = Block.get_font(font, ref_size).getbbox(text)
+        try:
+            estimate = int(ref_size * min(x_target/ref_dim[2], y_target/ref_dim[3]))
+        except ZeroDivisionError:
+            estimate = ref_size
+        estimate = max(1, estimate)
+        logging.debug(f'estimated font size: {estimate}')
+
+        # bracket the answer: `low` always fits, `high` never fits
+        step = 1
+        if fits(estimate):
+            low, high = estimate, None
+            while high is None:
+                if fits(low + step):
+                    low += step
+                    step *= 2
+                else:
+                    high = low + step
+        else:
+            low, high = None, estimate
+            while low is None:
+                if high - step < 1:
+                    low = 0
+                elif fits(high - step):
+                    low = high - step
+                else:
+                    high -= step
+                    step *= 2
+
+        # binary search within the bracket
+        while high - low > 1:
+            mid = (low + high)//2
+            if fits(mid):
+                low = mid
+            else:
+                high = mid
 
-        fontsize -= 1
+        fontsize = low
         logging.debug(f'calculated font size: {fontsize}')
         return fontsize
     
     def update_block_props(self, block, props={}, force_recalc=False):
-        '''update the properties of a block and optionally recalculates all of the 
-        block areas 
+        '''update the properties of a block and optionally recalculate the areas and 
+        positions of the block and the blocks that are positioned relative to it
+        
+        Only the blocks whose area or position changed are rebuilt or moved; rebuilt 
+        blocks are empty until their contents are updated with `update_contents`.
         
         block(str): name of block
         props(dict): properties to update or add
-        force_recalc(bool): force recalculation of all blocks
+        force_recalc(bool): recalculate the area and position of the block and its
+            dependent blocks (use when the size, padding or position changes)
+            
+        Returns:
+            list: names of the blocks that were rebuilt or moved
         '''
+        props = self._copy_values(props)
+        record = FrozenSection({**self._master_layout[block], **props})
+        if 'relative' in props or 'abs_coordinates' in props:
+            # sort before changing the layout; missing sections and cycles leave it unchanged
+            self._sort_sections({**self._master_layout, block: record})
+        
+        self._master_layout[block] = record
         self.layout[block].update(props)
-        self.blocks[block] = self.set_block(block, self.layout[block], force_recalc)
+        if not force_recalc:
+            self.blocks[block] = self.set_block(block, self.layout[block])
+            self._dirty.add(block)
+            return [block]
+        
+        return self._relayout(block)
                 
     
     def update_contents(self, update=None):
+        '''update the contents of each block
+        
+        Blocks skip rendering when the new contents are identical to the current contents.
+        When `executor` is set, blocks are rendered concurrently.
+        
+        Args:
+            update(dict): {'block_name': contents}
+            
+        Sets:
+            rendered_blocks(list): names of blocks that were re-rendered
+            
+        Returns:
+            list: names of blocks that were re-rendered'''
+        self.rendered_blocks = []
         if not update:
-            return
+            return self.rendered_blocks
         
         if not isinstance(update, dict):
             raise TypeError('update must be of type `dict`')
 
         unknown_keys = {}
+        known = {}
         for key, val in update.items():
             if key in self.blocks:
-                self.blocks[key].update(val)
+                known[key] = val
             else:
                 unknown_keys[key] = val
                 # logging.debug(f'"{key}" is not a recognized block, skipping')
+        
+        images = {key: self.blocks[key].image for key in known}
+        if self.executor:
+            self._update_concurrent(known)
+        else:
+            for key, val in known.items():
+                self.blocks[key].update(val)
+                
+        for key in known:
+            if self.blocks[key].image is not images[key]:
+                self.rendered_blocks.append(key)
+                self._dirty.add(key)
 
         if len(unknown_keys) > 0:
             logging.debug(f'{len(unknown_keys)} unrecognized keys were provided, but not used')
+
+        logging.debug(f'rendered blocks: {self.rendered_blocks}')
+        return self.rendered_blocks
             
                 
-    def concat(self):
-        self.image = Image.new(self.mode, self.resolution, 'white')
-        if self.blocks:
-            for b in self.blocks:
-                self.image.paste(self.blocks[b].image, self.blocks[b].abs_coordinates)
+    def _update_concurrent(self, update):
+        '''render blocks concurrently using `executor`
+        
+        Args:
+            update(dict): {'block_name': contents} for known blocks'''
+        # concurrent.futures imports ProcessPoolExecutor on first use
+        process = sys.modules.get('concurrent.futures.process')
+        processes = process is not None and isinstance(self.executor, process.ProcessPoolExecutor)
+        futures = {}
+        for key, val in update.items():
+            block = self.blocks[key]
+            # only image blocks are farmed out; text blocks share fonts (see `executor`)
+            if not isinstance(block, Block.ImageBlock) or block._is_rendered(block._render_key(val)):
+                block.update(val)
+            elif processes:
+                futures[key] = self.executor.submit(Block.render_block, block, val)
+            else:
+                futures[key] = self.executor.submit(block.update, val)
+        
+        logging.debug(f'rendering {len(futures)} blocks concurrently')
+        for key, future in futures.items():
+            if processes:
+                state, result = future.result()
+                self.blocks[key].__dict__.update(state)
+            else:
+                future.result()
+    
+    def _reset_canvas(self):
+        '''discard the persistent canvas; the next `concat` repastes all blocks'''
+        self.image = None
+        self.changed_boxes = []
+        self.rendered_blocks = []
+        self._dirty = set()
+        self._pasted = {}
+    
+    @staticmethod
+    def _transform_box(box, size, transform):
+        '''map a box (x0, y0, x1, y1) in an image of `size` through a PIL.Image.Transpose operation'''
+        x0, y0, x1, y1 = box
+        w, h = size
+        T = Image.Transpose
+        return {None: (x0, y0, x1, y1),
+                T.FLIP_LEFT_RIGHT: (w - x1, y0, w - x0, y1),
+                T.FLIP_TOP_BOTTOM: (x0, h - y1, x1, h - y0),
+                T.ROTATE_90: (y0, w - x1, y1, w - x0),
+                T.ROTATE_180: (w - x1, h - y1, w - x0, h - y0),
+                T.ROTATE_270: (h - y1, x0, h - y0, x1),
+                T.TRANSPOSE: (y0, x0, y1, x1),
+                T.TRANSVERSE: (h - y1, w - x1, h - y0, w - x0)}[transform]
+    
+    @staticmethod
+    def _overlaps(box, boxes):
+        '''True if `box` (x0, y0, x1, y1) intersects any box in `boxes`'''
+        for other in boxes:
+            if box[0] < other[2] and other[0] < box[2] and box[1] < other[3] and other[1] < box[3]:
+                return True
+        return False
+    
+    def concat(self, full=False):
+        '''join all blocks into a single image and set the `image` property
+        
+        The image is a persistent canvas: only blocks that changed since the last call 
+        (updated through `update_contents`, `update_block_props` or with a new `image`)
+        and blocks that overlap them are pasted. The bounding boxes of the changed 
+        regions are stored in `changed_boxes` as (x0, y0, x1, y1) tuples.
+        
+        When `transform` is set, blocks are transposed as they are pasted and the image and
+        `changed_boxes` are in the transformed (panel) orientation.
+        
+        Args:
+            full(bool): discard the canvas and paste all blocks
+        
+        Returns:
+            PIL.Image'''
+        size = tuple(self.resolution)
+        canvas_size = self._transform_box((0, 0) + size, size, self.transform)[2:]
+        if (full or self.image is None or self.image.mode != self.mode 
+                or self.image.size != canvas_size):
+            full = True
+        
+        boxes = {}
+        dirty = set()
+        for name, block in self.blocks.items():
+            x, y = block.abs_coordinates
+            boxes[name] = (x, y, x + block.image.width, y + block.image.height)
+            last = self._pasted.get(name)
+            if name in self._dirty or not last or last[0] is not block.image:
+                dirty.add(name)
+                # a block that moved or changed size leaves stale pixels behind
+                if last and last[1] != boxes[name]:
+                    full = True
+        
+        if full:
+            logging.debug('pasting all blocks into a new canvas')
+            self.image = Image.new(self.mode, canvas_size, 'white')
+            self._pasted = {}
+            self.changed_boxes = [(0, 0, self.image.width, self.image.height)]
+            dirty = set(self.blocks)
+        else:
+            self.changed_boxes = []
+        
+        # paste in layout order; repaste clean blocks that overlap a changed block
+        pasted = []
+        for name, block in self.blocks.items():
+            if name in dirty or self._overlaps(boxes[name], pasted):
+                if self.transform is None:
+                    self.image.paste(block.image, block.abs_coordinates)
+                else:
+                    box = self._transform_box(boxes[name], size, self.transform)
+                    self.image.paste(block.image.transpose(self.transform), box[:2])
+                self._pasted[name] = (block.image, boxes[name])
+                pasted.append(boxes[name])
+        
+        if not full:
+            self.changed_boxes = [self._transform_box(box, size, self.transform) for box in pasted]
+        
+        logging.debug(f'pasted {len(pasted)} of {len(self.blocks)} blocks')
+        self._dirty = set()
         return self.image    
 
+    def tiles(self, tile_height=None):
+        '''yield the layout as horizontal bands without building a full-frame image
+        
+        Each band is composed from the parts of the blocks that overlap it, in layout order.
+        When `transform` is set, the bands are in the transformed (panel) orientation and 
+        only the part of each block inside a band is transposed. Peak memory is one band 
+        plus one block slice instead of a full frame. The persistent `concat` canvas is 
+        not used or changed.
+        
+        Usage:
+            layout = Layout(resolution=screen.resolution, layout=l, transform=screen.transform)
+            screen.write_tiles(layout.tiles())
+        
+        Args:
+            tile_height(int): height of bands in pixels (default: constants.TILE_HEIGHT)
+            
+        Yields:
+            ((x0, y0, x1, y1), PIL.Image): box of the band in the canvas and the band image'''
+        if tile_height is None:
+            tile_height = constants.TILE_HEIGHT
+        if tile_height < 1:
+            raise ValueError(f'tile_height must be integer > 0: {tile_height}')
+        size = tuple(self.resolution)
+        width, height = self._transform_box((0, 0) + size, size, self.transform)[2:]
+        T = Image.Transpose
+        inverse = {T.ROTATE_90: T.ROTATE_270, T.ROTATE_270: T.ROTATE_90}.get(self.transform, self.transform)
+        
+        placed = []
+        for block in self.blocks.values():
+            x, y = block.abs_coordinates
+            box = (x, y, x + block.image.width, y + block.image.height)
+            placed.append((self._transform_box(box, size, self.transform), block.image))
+        
+        for y0 in range(0, height, tile_height):
+            y1 = min(y0 + tile_height, height)
+            tile = Image.new(self.mode, (width, y1 - y0), 'white')
+            for box, image in placed:
+                if not (box[1] < y1 and y0 < box[3]):
+                    continue
+                top, bottom = max(box[1], y0), min(box[3], y1)
+                if self.transform is None:
+                    part = image.crop((0, top - box[1], image.width, bottom - box[1]))
+                else:
+                    # the slice of the transposed block in this band, mapped back to the block
+                    block_size = (box[2] - box[0], box[3] - box[1])
+                    crop = self._transform_box((0, top - box[1], block_size[0], bottom - box[1]),
+                                               block_size, inverse)
+                    part = image.crop(crop).transpose(self.transform)
+                tile.paste(part, (box[0], top - y0))
+            yield (0, y0, width, y1), tile
+
 
 
 
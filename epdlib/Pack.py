@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''pack images into the native buffer formats of waveshare panels
+
+Many waveshare_epd drivers build their buffers in `getbuffer()` with per-pixel
+Python loops. The formats below are packed by Pillow's C packers instead:
+    1 bit per pixel, MSB first (black and white and bi-color panels)
+    2 bits per pixel palette indexes (4 color panels)
+    4 bits per pixel palette indexes (7 color panels)
+
+Images in the panel's landscape/portrait orientation are rotated by 90 degrees
+like the drivers do. Drivers differ in the details (order of dithering and
+rotation, value of the padding bits), so `detect_format()` compares each
+candidate with the driver's own buffer and only a format that matches byte for
+byte is used.
+'''
+
+import logging
+from PIL import Image
+
+try:
+    from . import constants
+    from . import Palette
+except ImportError as e:
+    import constants
+    import Palette
+
+
+class PackError(Exception):
+    pass
+
+
+# name: (bits per pixel, options)
+FORMATS = {
+    '1bpp': (1, {'dither_first': True, 'pad': True}),
+    '1bpp_pad0': (1, {'dither_first': True, 'pad': False}),
+    '1bpp_rotate_first': (1, {'dither_first': False, 'pad': True}),
+    '1bpp_rotate_first_pad0': (1, {'dither_first': False, 'pad': False}),
+    '2bpp_4color': (2, {'colors': tuple(constants.COLORS_4_WS.values())}),
+    '4bpp_7color': (4, {'colors': tuple(constants.COLORS_7_WS.values())}),
+}
+
+
+def buffer_size(width, height, bits):
+    '''return the length in bytes of a buffer with rows padded to whole bytes'''
+    return (width*bits + 7)//8*height
+
+
+def _orient(image, width, height):
+    '''rotate portrait images for landscape panels (and the reverse) by 90 degrees'''
+    if image.size == (width, height):
+        return image
+    if image.size == (height, width):
+        return image.transpose(Image.Transpose.ROTATE_90)
+    raise PackError(f'image size {image.size} does not match panel {width}x{height}')
+
+
+def pack_1bpp(image, width, height, dither_first=True, pad=True):
+    '''pack an image as 1 bit per pixel, MSB first; 1 is white
+
+    Args:
+        image(PIL.Image): image to pack
+        width(int): native panel width
+        height(int): native panel height
+        dither_first(bool): convert to 1 bit before rotating (the order matters for dithered images)
+        pad(bool): set the bits that pad each row to a whole byte (False: clear them)
+
+    Returns:
+        bytearray'''
+    if dither_first:
+        image = _orient(image.convert('1'), width, height)
+    else:
+        image = _orient(image, width, height).convert('1')
+    if pad and width % 8:
+        canvas = Image.new('1', ((width + 7)//8*8, height), 1)
+        canvas.paste(image)
+        image = canvas
+    return bytearray(image.tobytes())
+
+
+def pack_indexed(image, width, height, colors, bits):
+    '''reduce an image to a palette with Floyd-Steinberg dithering and pack the palette
+    indexes at 2 or 4 bits per pixel, first pixel in the high bits
+
+    Args:
+        image(PIL.Image): image to pack
+        width(int): native panel width
+        height(int): native panel height
+        colors(tuple): palette colors in panel order
+        bits(int): 2 or 4
+
+    Returns:
+        bytearray'''
+    reduced = Palette.get_palette(colors).reduce(_orient(image, width, height), dither='floydsteinberg')
+    return bytearray(reduced.tobytes('raw', f'P;{bits}'))
+
+
+def pack(image, width, height, fmt):
+    '''pack an image in one of FORMATS
+
+    Args:
+        image(PIL.Image): image to pack
+        width(int): native panel width
+        height(int): native panel height
+        fmt(str): key of FORMATS
+
+    Returns:
+        bytearray'''
+    bits, options = FORMATS[fmt]
+    if bits == 1:
+        return pack_1bpp(image, width, height, **options)
+    return pack_indexed(image, width, height, options['colors'], bits)
+
+
+def matching_formats(image, driver_buffer, width, height, formats=None):
+    '''return the formats that pack `image` into exactly `driver_buffer`
+
+    Args:
+        image(PIL.Image): image passed to the driver's `getbuffer()`
+        driver_buffer(list or bytearray): buffer returned by the driver's `getbuffer()`
+        width(int): native panel width
+        height(int): native panel height
+        formats(iterable of str): keys of FORMATS to try (default: all)
+
+    Returns:
+        list of str: keys of FORMATS'''
+    try:
+        driver_buffer = bytes(driver_buffer)
+    except (TypeError, ValueError) as e:
+        logging.debug(f'driver buffer is not a sequence of bytes: {e}')
+        return []
+    matches = []
+    for fmt in (FORMATS if formats is None else formats):
+        bits, options = FORMATS[fmt]
+        if len(driver_buffer) != buffer_size(width, height, bits):
+            continue
+        try:
+            if pack(image, width, height, fmt) == driver_buffer:
+                matches.append(fmt)
+        except PackError as e:
+            logging.debug(f'could not pack {fmt}: {e}')
+    logging.debug(f'driver buffer matches formats: {matches}')
+    return matches
+
+
+def distinct_formats(formats, image, width, height):
+    '''drop formats that pack all images with the mode and size of `image` identically
+    to an earlier format
+
+    1 bit formats differ in the order of converting and rotating only for images that
+    are rotated and not already 1 bit, and in the padding bits only for widths that
+    are not a multiple of 8.
+
+    Args:
+        formats(iterable of str): keys of FORMATS
+        image(PIL.Image): image of the mode and size to compare
+        width(int): native panel width
+        height(int): native panel height
+
+    Returns:
+        list of str: keys of FORMATS'''
+    rotated = image.size != (width, height) and image.mode != '1'
+    distinct = {}
+    for fmt in formats:
+        bits, options = FORMATS[fmt]
+        key = (bits, options.get('colors'),
+               options.get('dither_first') if rotated else None,
+               options.get('pad') if width % 8 else None)
+        distinct.setdefault(key, fmt)
+    return list(distinct.values())
+
+
+def detect_format(image, driver_buffer, width, height):
+    '''find the format that packs `image` into exactly `driver_buffer`
+
+    Simple images (e.g. pure black and white) are packed identically by several
+    formats; the format is only known when the matching formats pack all images of
+    this size identically (see `distinct_formats`).
+
+    Args:
+        image(PIL.Image): image passed to the driver's `getbuffer()`
+        driver_buffer(list or bytearray): buffer returned by the driver's `getbuffer()`
+        width(int): native panel width
+        height(int): native panel height
+
+    Returns:
+        str: key of FORMATS or None if no format or more than one format matches'''
+    matches = distinct_formats(matching_formats(image, driver_buffer, width, height),
+                               image, width, height)
+    return matches[0] if len(matches) == 1 else None
@@ -0,0 +1,300 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''reduce images to a fixed palette such as the waveshare 7-color panel palette
+
+Dithering kernels:
+    None: nearest color
+    'floydsteinberg': Floyd-Steinberg error diffusion
+    'atkinson': Atkinson error diffusion (lighter, higher contrast)
+    'bayer': ordered dithering with an 8x8 Bayer matrix
+
+None and 'floydsteinberg' use Pillow's `Image.quantize()` with a palette image that
+is built once per palette; Pillow's C implementation is faster than a NumPy lookup
+for these. 'atkinson' and 'bayer' are vectorized with NumPy and find nearest colors
+through a lookup table (LUT) that maps every RGB value (truncated to
+`constants.PALETTE_LUT_BITS` per channel) to a palette index. The table is built once
+per palette.
+
+NumPy is optional. Without it only None and 'floydsteinberg' are available.
+
+Usage:
+    p = get_palette()
+    reduced = p.reduce(image, dither='atkinson')
+'''
+
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from PIL import Image, ImageColor
+
+# numpy is optional and imported on first use; see _numpy()
+np = None
+
+try:
+    from . import constants
+except ImportError as e:
+    import constants
+
+
+# error diffusion kernels: (dy, dx, weight)
+KERNELS = {
+    'atkinson': ((0, 1, 1/8), (0, 2, 1/8), (1, -1, 1/8), (1, 0, 1/8), (1, 1, 1/8), (2, 0, 1/8)),
+}
+
+DITHERS = (None, 'floydsteinberg', 'atkinson', 'bayer')
+# dithers implemented by Pillow; reducing is cheaper than hashing the image for the cache
+PILLOW_DITHERS = (None, 'floydsteinberg')
+
+
+class PaletteError(Exception):
+    pass
+
+
+def _numpy():
+    '''import numpy on first use
+    
+    Returns:
+        numpy module or None if numpy is not installed'''
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            return None
+        np = numpy
+    return np
+
+
+def _bayer(n):
+    '''return an n x n Bayer threshold matrix (n is a power of 2) scaled to -0.5..0.5'''
+    matrix = np.zeros((1, 1), dtype=np.float32)
+    while matrix.shape[0] < n:
+        matrix = np.block([[4*matrix, 4*matrix+2], [4*matrix+3, 4*matrix+1]])
+    return (matrix + 0.5)/matrix.size - 0.5
+
+
+class Palette:
+    '''fixed color palette with a cached nearest-color lookup table and dithering'''
+    def __init__(self, colors=constants.COLORS_7_WS.values(), lut_bits=constants.PALETTE_LUT_BITS,
+                 cache_size=constants.PALETTE_CACHE_SIZE):
+        '''create a palette
+
+        Args:
+            colors(list): colors as RGB tuples, strings of hex values or CSS3-style color specifiers
+            lut_bits(int): bits per channel used for the nearest-color lookup table (1-8)
+            cache_size(int): number of reduced images to keep
+
+        Properties:
+            colors(tuple of tuple): RGB colors in palette order
+            hits(int): number of `reduce()` calls answered from the cache
+            misses(int): number of `reduce()` calls that reduced an image'''
+        rgb = []
+        for color in colors:
+            if isinstance(color, str):
+                color = ImageColor.getcolor(color, 'RGB')
+            rgb.append(tuple(color))
+        if not rgb:
+            raise PaletteError('palette must contain at least one color')
+        if len(rgb) > 256:
+            raise PaletteError(f'palette may contain at most 256 colors: {len(rgb)}')
+        if not 1 <= lut_bits <= 8:
+            raise PaletteError(f'lut_bits must be between 1 and 8: {lut_bits}')
+        self.colors = tuple(rgb)
+        self.lut_bits = lut_bits
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self._lut = None
+        self._pil_image = None
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f'Palette({len(self.colors)} colors)'
+
+    def pil_palette(self, num_colors=256):
+        '''return the palette as a flat list of values padded with black to `num_colors`
+
+        Args:
+            num_colors(int): number of colors in the color space (default 256)'''
+        palette = [v for color in self.colors for v in color]
+        return palette + [0, 0, 0] * (num_colors - len(self.colors))
+
+    @property
+    def lut(self):
+        '''numpy.ndarray: palette index for each RGB value truncated to `lut_bits` per channel
+
+        The table is built on first use. Duplicate colors map to the first occurrence.'''
+        if self._lut is None:
+            if _numpy() is None:
+                raise PaletteError('numpy is required for the palette lookup table')
+            bits = self.lut_bits
+            shift = 8 - bits
+            # nearest color to the center of each cell
+            centers = (np.arange(1 << bits, dtype=np.int32) << shift) + ((1 << shift) >> 1)
+            grid = np.stack(np.meshgrid(centers, centers, centers, indexing='ij'), axis=-1).reshape(-1, 3)
+            # palettes padded with black contain many duplicates; search only unique colors
+            colors, first = np.unique(np.array(self.colors, dtype=np.int32), axis=0, return_index=True)
+            lut = np.empty(len(grid), dtype=np.uint8)
+            # build in chunks to limit memory use
+            step = 1 << 15
+            for start in range(0, len(grid), step):
+                distance = ((grid[start:start+step, None, :] - colors)**2).sum(axis=-1)
+                lut[start:start+step] = first[distance.argmin(axis=-1)]
+            self._lut = lut
+            logging.debug(f'built {len(lut)} entry lookup table for {self}')
+        return self._lut
+
+    def nearest(self, pixels):
+        '''return the palette index of the nearest color for each pixel
+
+        Args:
+            pixels(numpy.ndarray): (..., 3) array of RGB values; values outside 0-255 are clipped
+
+        Returns:
+            numpy.ndarray: uint8 array of palette indexes with the shape pixels.shape[:-1]'''
+        lut = self.lut
+        bits = self.lut_bits
+        if pixels.dtype != np.uint8:
+            pixels = np.clip(pixels, 0, 255).astype(np.uint8)
+        pixels = pixels >> (8 - bits)
+        index = np.left_shift(pixels[..., 0], 2*bits, dtype=np.uint32)
+        index |= np.left_shift(pixels[..., 1], bits, dtype=np.uint32)
+        index |= pixels[..., 2]
+        return lut.take(index)
+
+    def indexes(self, image, dither=None):
+        '''return the palette index of each pixel in an image
+
+        Args:
+            image(PIL.Image): image to reduce
+            dither(str): one of DITHERS
+
+        Returns:
+            numpy.ndarray: (height, width) uint8 array of palette indexes'''
+        if dither not in DITHERS:
+            raise PaletteError(f'unknown dither: {dither}; use one of {DITHERS}')
+        if _numpy() is None:
+            raise PaletteError('numpy is required for palette indexes')
+        if dither in PILLOW_DITHERS:
+            return np.asarray(self._quantize(image, dither))
+        pixels = np.asarray(image.convert('RGB'))
+        if dither == 'bayer':
+            return self._ordered(pixels)
+        return self._diffuse(pixels, KERNELS[dither])
+
+    def _quantize(self, image, dither):
+        '''reduce an image with Pillow's `Image.quantize()`'''
+        if self._pil_image is None:
+            p = Image.new('P', (1, 1))
+            p.putpalette(self.pil_palette())
+            self._pil_image = p
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        pil_dither = Image.Dither.FLOYDSTEINBERG if dither else Image.Dither.NONE
+        return image.quantize(palette=self._pil_image, dither=pil_dither)
+
+    def _ordered(self, pixels):
+        '''ordered dithering with an 8x8 Bayer matrix'''
+        height, width = pixels.shape[:2]
+        threshold = np.tile(_bayer(8), (height//8 + 1, width//8 + 1))[:height, :width]
+        return self.nearest(pixels + threshold[..., None]*constants.PALETTE_BAYER_SPREAD)
+
+    def _diffuse(self, pixels, kernel):
+        '''error diffusion dithering
+
+        The KERNELS only spread error to pixels with a larger x + 2y, so all pixels on
+        a diagonal with the same x + 2y are quantized as one vector.'''
+        height, width = pixels.shape[:2]
+        margin = max(abs(dx) for dy, dx, w in kernel)
+        depth = max(dy for dy, dx, w in kernel)
+        stride = width + 2*margin
+        work = np.zeros((height + depth, stride, 3), dtype=np.float32)
+        work[:height, margin:margin+width] = pixels
+        work = work.reshape(-1, 3)
+        colors = np.array(self.colors, dtype=np.float32)
+        offsets = [(dy*stride + dx, weight) for dy, dx, weight in kernel]
+        result = np.empty(height*width, dtype=np.uint8)
+        rows = np.arange(height)
+
+        for t in range(width + 2*(height - 1)):
+            y = rows[max(0, (t - width)//2 + 1):min(height - 1, t//2) + 1]
+            x = t - 2*y
+            position = y*stride + x + margin
+            values = work[position]
+            index = self.nearest(values)
+            result[y*width + x] = index
+            error = values - colors[index]
+            for offset, weight in offsets:
+                work[position + offset] += error*weight
+        return result.reshape(height, width)
+
+    def reduce(self, image, dither=None, cache=None):
+        '''reduce an image to the palette
+
+        Results are cached by image contents; repeated frames are not reduced again.
+
+        Args:
+            image(PIL.Image or str): image or path to image
+            dither(str): one of DITHERS
+            cache(bool): use the cache of reduced images (default: True for dithers
+                that are not in PILLOW_DITHERS)
+
+        Returns:
+            PIL.Image: 'P' mode image with this palette'''
+        if isinstance(image, str):
+            image = Image.open(image)
+        if dither not in DITHERS:
+            raise PaletteError(f'unknown dither: {dither}; use one of {DITHERS}')
+
+        if cache is None:
+            cache = dither not in PILLOW_DITHERS
+        key = None
+        if cache and self.cache_size:
+            key = (hashlib.blake2b(image.tobytes(), digest_size=16).digest(), image.mode, image.size, dither)
+            with self._lock:
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    self.hits += 1
+                    return self._cache[key].copy()
+
+        if dither in PILLOW_DITHERS or _numpy() is None:
+            if dither not in PILLOW_DITHERS:
+                raise PaletteError(f'numpy is required for {dither} dithering')
+            reduced = self._quantize(image, dither)
+        else:
+            reduced = Image.frombytes('P', image.size, self.indexes(image, dither).tobytes())
+            reduced.putpalette(self.pil_palette())
+
+        with self._lock:
+            self.misses += 1
+            if key:
+                self._cache[key] = reduced.copy()
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return reduced
+
+    def clear_cache(self):
+        '''discard all cached reduced images'''
+        with self._lock:
+            self._cache.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+@lru_cache(maxsize=16)
+def _get_palette(colors):
+    return Palette(colors)
+
+
+def get_palette(colors=constants.COLORS_7_WS.values()):
+    '''return a shared Palette object for a set of colors
+
+    Palettes are created once so their lookup tables and image caches are shared.
+
+    Args:
+        colors(list): colors as RGB tuples, strings of hex values or CSS3-style color specifiers'''
+    return _get_palette(tuple(c if isinstance(c, str) else tuple(c) for c in colors))
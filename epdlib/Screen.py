@@ -27,42 +27,58 @@ import logging
 import sys
 import time
 import subprocess
+import threading
+from concurrent.futures import Future
+try:
+    from concurrent.futures import InvalidStateError
+except ImportError:
+    # python < 3.8: set_result() does not check the state of the future
+    InvalidStateError = RuntimeError
 
 # +
 import logging
-from PIL import Image, ImageDraw, ImageOps, ImageColor
+import hashlib
+import json
+from PIL import Image, ImageDraw, ImageColor, ImageChops
 from datetime import datetime
 from pathlib import Path
-from gpiozero import GPIODeviceError
 import time
 
 try:
     from . import constants
+    from . import Pack
+    from . import Palette
+    from . import VirtualEPD
+    from .Validate import strict_enforce
 except ImportError as e:
     import constants
+    import Pack
+    import Palette
+    import VirtualEPD
+    from Validate import strict_enforce
 
 # from waveshare_epd import epdconfig
 
 # + code_folding=[0]
-def strict_enforce(*types):
-    """decorator: strictly enforce type compliance within classes
-    
-    Usage:
-    @strict_enforce(type1, type2, (type3, type4))
-    def foo(val1, val2, val4):
-        ...
-    """
-    def decorator(f):
-        def new_f(self, *args, **kwds):
-            #we need to convert args into something mutable   
-            newargs = []        
-            for (a, t) in zip(args, types):
-                if not isinstance(a, t):
-                    raise TypeError(f'"{a}" is not type {t}')
-#                 newargs.append( t(a)) #feel free to have more elaborated convertion
-            return f(self, *args, **kwds)
-        return new_f
-    return decorator
+# epd driver loaders: {name: (hd, loader)}
+DRIVERS = {}
+
+
+def register_driver(name, loader, hd=None):
+    '''register a function for loading an epd driver by name
+    
+    Names that are not registered are loaded from the waveshare_epd package.
+    
+    Args:
+        name(str): name used for `Screen(epd=name)`
+        loader(function): function(screen, epd) returning a dict with the keys:
+            epd, resolution, clear_args, one_bit_display, constants, mode
+        hd(bool): True if the driver provides the IT8951 interface
+            (default: `loader.hd` or False)'''
+    if hd is None:
+        hd = getattr(loader, 'hd', False)
+    DRIVERS[name] = (hd, loader)
+    logging.debug(f'registered epd driver: {name}')
 
 
 # + code_folding=[0]
@@ -229,7 +245,22 @@ class Screen():
             HD(bool): True for IT8951 panels
             rotation(int): rotation of screen (0, -90, 90, 180)
             mirror(bool): mirror the output 
-            update(obj:Update): monotoic time aware update timer'''
+            update(obj:Update): monotoic time aware update timer
+            partial_threshold(float): fraction of the screen that may change before a 
+                partial refresh is promoted to a full refresh
+            max_partials(int): number of consecutive partial refreshes before a full
+                refresh is forced
+            partial_count(int): number of partial refreshes since the last full refresh
+            dedup(bool): skip writing frames that are identical to the last frame written
+            skipped_writes(int): number of writes skipped by `dedup`
+            packed_buffers(bool): pack non HD buffers in epdlib instead of the driver's
+                `getbuffer()` when the packed buffer matches the driver's buffer (default: True)
+            bytes_copied(int): bytes copied into the HD frame buffer by the last write'''
+        self._spi_lock = threading.RLock()
+        self._writer_cond = threading.Condition()
+        self._writer_thread = None
+        self._writer_stop = False
+        self._pending = None
         self.vcom = vcom        
         self.resolution = kwargs.get('resolution', [1, 1])
         self.clear_args  = kwargs.get('clear_args', {})
@@ -237,9 +268,19 @@ class Screen():
         self.constants = kwargs.get('constants', None)
         self.mode = kwargs.get('mode', None)
         self.HD = kwargs.get('HD', False)
+        self.packed_buffers = kwargs.get('packed_buffers', True)
+        self._buffer_formats = {}
         self.epd = epd
         self.rotation = rotation
         self.mirror = kwargs.get('mirror', False)
+        self.partial_threshold = kwargs.get('partial_threshold', constants.PARTIAL_REFRESH_THRESHOLD)
+        self.max_partials = kwargs.get('max_partials', constants.PARTIAL_REFRESH_MAX)
+        self.partial_count = 0
+        self.last_frame = None
+        self.dedup = kwargs.get('dedup', False)
+        self.skipped_writes = 0
+        self._last_hash = None
+        self.bytes_copied = 0
         self.update = Update()
         
     def _spi_handler(func):
@@ -254,45 +295,48 @@ class Screen():
         def wrapper(*args, **kwargs):
             # self
             obj = args[0]
-            if not obj.epd:
-                raise UnboundLocalError('no epd is configured')
+            # serialize access to the display between threads
+            with obj._spi_lock:
+                if not obj.epd:
+                    raise UnboundLocalError('no epd is configured')
+
+                logging.debug('initing display')
+                # open the SPI file objects
+                if not obj.HD:
+                    logging.debug('Non HD display')
+                    try:
+                        # `_writeEPD` passes the regions of a partial refresh as `boxes`
+                        obj._init_non_hd(partial=bool(kwargs.get('boxes')))
+                    except FileNotFoundError as e:
+                        raise FileNotFoundError(f'It appears SPI is not enabled on this Pi: {e}')
+                    except Exception as e:
+                        raise ScreenError(f'failed to init display: {e}')
+
+                    # run the SPI read/write command here
+                    func(*args, **kwargs)
+                    obj.update.update()    
+
+                    logging.debug('sleeping display')
 
-            logging.debug('initing display')
-            # open the SPI file objects
-            if not obj.HD:
-                logging.debug('Non HD display')
-                try:
-                    obj.epd.init()
-                except FileNotFoundError as e:
-                    raise FileNotFoundError(f'It appears SPI is not enabled on this Pi: {e}')
-                except Exception as e:
-                    raise ScreenError(f'failed to init display: {e}')
-
-                # run the SPI read/write command here
-                func(*args, **kwargs)
-                obj.update.update()    
-
-                logging.debug('sleeping display')
-
-                # close the SPI file objects
-                try:
-                    obj.epd.sleep()
-                except Exception as e:
-                    raise ScreenError(f'failed to sleep display: {e}')
+                    # close the SPI file objects
+                    try:
+                        obj.epd.sleep()
+                    except Exception as e:
+                        raise ScreenError(f'failed to sleep display: {e}')
                     
-            if obj.HD:
-                logging.debug('HD display')
-                try:
-                    obj.epd.epd.run()
-                except Exception as e:
-                    raise ScreenError(f'failed to init display')
-                func(*args, **kwargs)
+                if obj.HD:
+                    logging.debug('HD display')
+                    try:
+                        obj.epd.epd.run()
+                    except Exception as e:
+                        raise ScreenError(f'failed to init display')
+                    func(*args, **kwargs)
                 
-                logging.debug('sleeping display')
-                try:
-                    obj.epd.epd.sleep()
-                except Exception as e:
-                    raise ScreenError(f'failed to sleep display: {e}')
+                    logging.debug('sleeping display')
+                    try:
+                        obj.epd.epd.sleep()
+                    except Exception as e:
+                        raise ScreenError(f'failed to sleep display: {e}')
         # update monotonic clock 
         return wrapper
         
@@ -307,9 +351,11 @@ class Screen():
         
         use `Screen().list_compatible_modules()` to see a list of supported non IT8951 screens
         use "HD" for IT8951 screens
+        use "virtual", "virtual_7color" or "virtual_hd" for virtual panels (see VirtualEPD)
         
         Args:
-            epd(str): name of waveshare module, or "HD" for IT8951 based screens
+            epd(str): name of waveshare module, "HD" for IT8951 based screens or 
+                the name of a driver added with `register_driver()`
         
         Sets:
             epd(obj): epd read/write object
@@ -325,9 +371,9 @@ class Screen():
         
         myepd = None
         
-        if epd == 'HD':
-            self.HD = True
-            myepd = self._load_hd(epd)
+        if epd in DRIVERS:
+            self.HD, loader = DRIVERS[epd]
+            myepd = loader(self, epd)
         else:
             self.HD = False
             myepd = self._load_non_hd(epd)
@@ -342,6 +388,8 @@ class Screen():
         self.constants = myepd['constants']
         self.one_bit_display = myepd['one_bit_display']
         self.mode = myepd['mode']
+        self._buffer_formats = {}
+        self._init_modes = None if self.HD else self._driver_init_modes(self._epd)
         
         
         if not self.one_bit_display and self.mode not in('L', 'RGB'):
@@ -350,6 +398,44 @@ class Screen():
         
         logging.debug(f'epd configuration {myepd}')
         
+    @staticmethod
+    def _driver_init_modes(epd):
+        '''return the (full, partial) refresh mode arguments of `epd.init()`
+        
+        Some waveshare drivers select the refresh mode with an argument to `init()`:
+        `init(update)` with `FULL_UPDATE` and `PART_UPDATE` (e.g. epd2in13_V2) or 
+        `init(lut)` with `lut_full_update` and `lut_partial_update` (e.g. epd2in13).
+        
+        Returns:
+            tuple or None: None when `init()` takes no refresh mode'''
+        import inspect
+        
+        try:
+            if not inspect.signature(epd.init).parameters:
+                return None
+        except (AttributeError, TypeError, ValueError):
+            return None
+        for full, part in (('FULL_UPDATE', 'PART_UPDATE'), ('lut_full_update', 'lut_partial_update')):
+            if hasattr(epd, full) and hasattr(epd, part):
+                return (getattr(epd, full), getattr(epd, part))
+        return None
+    
+    def _init_non_hd(self, partial=False):
+        '''init a non HD display for a full or partial refresh
+        
+        Drivers with `init_part()` (e.g. epd7in5_V2) use it before partial refreshes; drivers 
+        that take the refresh mode as an argument get it (see `_driver_init_modes`). Other 
+        drivers set up the partial refresh in `displayPartial()`.
+        
+        Args:
+            partial(bool): init for `displayPartial()`'''
+        if partial and hasattr(self.epd, 'init_part'):
+            logging.debug('init display for partial refresh: init_part()')
+            return self.epd.init_part()
+        if self._init_modes:
+            return self.epd.init(self._init_modes[1] if partial else self._init_modes[0])
+        return self.epd.init()
+        
     @property 
     def vcom(self):
         return self._vcom
@@ -394,6 +480,7 @@ class Screen():
                 self.buffer_no_image = self.epd.getbuffer(self.blank_image())
 
         self._rotation = rotation
+        self._set_transform()
         logging.debug(f'rotation={rotation}, resolution={self.resolution}')        
 
     @property
@@ -406,7 +493,77 @@ class Screen():
     @strict_enforce(bool)
     def mirror(self, mirror):
         self._mirror = mirror
+        self._set_transform()
         logging.debug(f'mirror output: {mirror}')
+
+    @property
+    def transform(self):
+        '''PIL.Image.Transpose operation that maps images in screen orientation to panel 
+        orientation: `rotation` followed by `mirror` (None: no transform)
+        
+        Pass this to `Layout(transform=...)` to render in panel orientation and write the 
+        images with `writeEPD(image, transformed=True)`.'''
+        return self._transform
+    
+    def _set_transform(self):
+        '''look up the single transpose operation for the current rotation and mirror'''
+        if not hasattr(self, '_rotation') or not hasattr(self, '_mirror'):
+            return
+        name = constants.SCREEN_TRANSFORMS[(self._rotation, self._mirror)]
+        self._transform = Image.Transpose[name] if name else None
+        logging.debug(f'transform: {self._transform}')
+    
+    def transform_image(self, image):
+        '''return a copy of an image in panel orientation (see `transform`)
+        
+        Args:
+            image(PIL.Image): image in screen orientation
+        
+        Returns:
+            PIL.Image'''
+        try:
+            if self.transform is None:
+                return image.copy()
+            return image.transpose(self.transform)
+        except AttributeError as e:
+            raise ScreenError(f'image could not be rotated: {e}')
+
+    @property
+    def dedup(self):
+        '''skip the init/write/sleep cycle when a frame is identical to the last frame written'''
+        return self._dedup
+    
+    @dedup.setter
+    @strict_enforce(bool)
+    def dedup(self, dedup):
+        self._dedup = dedup
+        logging.debug(f'deduplicate frames: {dedup}')
+
+    @property
+    def partial_threshold(self):
+        '''fraction (0..1) of the screen area that may change in a partial refresh
+        
+        Partial refreshes that change more than this fraction are promoted to a full refresh'''
+        return self._partial_threshold
+    
+    @partial_threshold.setter
+    @strict_enforce((int, float))
+    def partial_threshold(self, partial_threshold):
+        if not 0 <= partial_threshold <= 1:
+            raise ValueError('partial_threshold must be between 0 and 1')
+        self._partial_threshold = partial_threshold
+        
+    @property
+    def max_partials(self):
+        '''number of consecutive partial refreshes before a full refresh is forced to clear ghosting'''
+        return self._max_partials
+    
+    @max_partials.setter
+    @strict_enforce(int)
+    def max_partials(self, max_partials):
+        if max_partials < 0:
+            raise ValueError('max_partials must be an integer >= 0')
+        self._max_partials = max_partials
         
     def _load_hd(self, epd, timeout=20):
         '''configure IT8951 (HD) SPI epd 
@@ -465,76 +622,33 @@ class Screen():
                 constants: None
                 '''
         
-        import waveshare_epd
-        # from waveshare_epd import epdconfig
-        import pkgutil
-        import inspect
         from importlib import import_module
         
         logging.debug(f'configuring waveshare_epd.{epd}')
         
-        non_hd = []
-        for i in pkgutil.iter_modules(waveshare_epd.__path__):
-            non_hd.append(i.name)
-        
-        if epd in non_hd:
-            try:
-                myepd = import_module(f'waveshare_epd.{epd}')
-            except ModuleNotFoundError as e:
-                raise ScreenError(f'failed to load {epd} with error: {e}')
-        else:
+        panel = panel_capabilities(epd)
+        if panel is None:
             raise ScreenError(f'unrecongized waveshare module: {epd}')
-
-        # check specs
-        # check for supported `Clear()` function
-        clear_args ={}
-        try:
-            clear_sig = inspect.signature(myepd.EPD.Clear)
-        except AttributeError as e:
+        if panel['error']:
+            raise ScreenError(f'failed to load {epd} with error: {panel["error"]}')
+        if panel['clear_params'] is None:
             raise ScreenError(f'{epd} has an unsupported `EPD.Clear()` function and is not usable with this module ')
-
-        color_default = clear_sig.parameters.get('color', False)
-        
-        # it appears that not all of the older waveshare epd screens have
-        # a default `color` parameter. For those use constants.CLEAR_COLOR (0xFF)
-        if color_default:
-            logging.debug(f'Clear() function has color parameter')
-            if color_default.default is color_default.empty:
-                clear_args['color'] = constants.CLEAR_COLOR
-                logging.debug(f'Clear(color) parameter has no default; using: {clear_args}')       
-
-        # check for "standard" `display()` function
-        try:
-            display_args_spec = inspect.getfullargspec(myepd.EPD.display)
-        except AttributeError:
+        if panel['display_arity'] is None:
             raise ScreenError(f'"{epd}" has an unsupported `EPD.display()` function and is not usable with this module')
-
-        logging.debug(f'args_spec: {display_args_spec.args}')
-        
-        # 2 and 3 color displays have >= 2 args
-        if len(display_args_spec.args) <= 2:
-            one_bit_display = True
-            mode = '1'
-        else:
-            one_bit_display = False
-            mode = 'L'
+        if panel['resolution'] is None:
+            raise ScreenError(f'"{epd}" does not define `EPD_WIDTH` and `EPD_HEIGHT` and is not usable with this module')
         
-        # use the presence of `BLUE` and `ORANGE` properties as evidence that this is a color display
-        if vars(myepd.EPD()).get('BLUE', False) and vars(myepd.EPD()).get('ORANGE', False):
-            one_bit_display = False
-            mode = 'RGB'
-        else:
-            mode = '1'
-                    
-        resolution = [myepd.EPD_HEIGHT, myepd.EPD_WIDTH]
-        resolution.sort(reverse=True)
+        try:
+            myepd = import_module(f'waveshare_epd.{epd}')
+        except ModuleNotFoundError as e:
+            raise ScreenError(f'failed to load {epd} with error: {e}')
         
         return {'epd': myepd.EPD(), 
-                'resolution': resolution, 
-                'clear_args': clear_args,
-                'one_bit_display': one_bit_display,
+                'resolution': list(panel['resolution']), 
+                'clear_args': dict(panel['clear_args']),
+                'one_bit_display': panel['one_bit_display'],
                 'constants': None,
-                'mode': mode}
+                'mode': panel['mode']}
     
     def initEPD(self, *args, **kwargs):
         '''**DEPRICATED** init EPD for wirting
@@ -558,6 +672,9 @@ class Screen():
         else:
             clear_function = self._clearEPD_non_hd
         
+        self.last_frame = None
+        self._last_hash = None
+        self.partial_count = 0
         return clear_function()
         
     
@@ -582,63 +699,408 @@ class Screen():
         
         
     
-    @_spi_handler
-    def writeEPD(self, image, sleep=True, partial=False):
+    def writeEPD(self, image, sleep=True, partial=False, force=False, transformed=False):
         '''write an image to the screen 
         
+        Partial writes compare the image with the last frame written and refresh only the 
+        regions that changed. A full refresh is used instead when there is no previous frame, 
+        the changed area is larger than `partial_threshold` or `max_partials` partial 
+        refreshes have been made since the last full refresh.
+        
+        When `dedup` is True, frames that are identical to the last frame written are 
+        skipped entirely (no init/write/sleep) and counted in `skipped_writes`.
+        
         Args:
             image(PIL image): image to display
             sleep(bool): put the display to sleep after writing () (Depricated kwarg)
-            partial(bool): attempt to do a partial refresh -- for 1bit pixels on HD Screens only'''
+            partial(bool): attempt to do a partial refresh -- for 1bit pixels on HD Screens and 
+                non HD screens that support `displayPartial()`
+            force(bool): write the image even if it is identical to the last frame written
+            transformed(bool): the image is already in panel orientation, e.g. rendered by a 
+                Layout created with `transform=screen.transform`'''
 
-        try:
-            image = image.rotate(self.rotation, expand=True)
-        except AttributeError as e:
-            raise ScreenError(f'image could not be rotated: {e}')
+        if not transformed:
+            image = self.transform_image(image)
 
-        if partial:
+        frame_hash = None
+        if self.dedup:
+            frame_hash = self.frame_hash(image)
+            
+        with self._spi_lock:
+            if frame_hash and frame_hash == self._last_hash and not force:
+                self.skipped_writes += 1
+                logging.debug(f'frame is identical to last frame written; skipping write ({self.skipped_writes} skipped)')
+                return True
+            
+            # the refresh is chosen before the display is woken; some drivers init differently
+            # for partial refreshes
+            boxes = None
+            if partial:
+                if self.HD or hasattr(self.epd, 'displayPartial'):
+                    boxes = self._partial_boxes(image)
+                else:
+                    logging.warning('partial update is not available on this display')
+            
+            # transformed images belong to the caller (e.g. a Layout canvas that the next 
+            # `concat()` changes in place); keep a copy to compare the next partial write with
+            self._writeEPD(image, boxes=boxes, keep_copy=transformed)
+            self._last_hash = frame_hash
+        
+        if sleep==False:
+            logging.warning('`sleep` kwarg is depricated and no longer used; display will be put to sleep after write')
+        
+        return True
+    
+    @_spi_handler
+    def _writeEPD(self, image, boxes=None, keep_copy=False):
+        '''write a rotated and mirrored image to the screen using a full or partial refresh
+        
+        Args:
+            image(PIL image): image to display
+            boxes(list of 4-tuple): regions to refresh with a partial refresh (see `_partial_boxes`);
+                None: full refresh; empty: nothing changed
+            keep_copy(bool): store a copy of `image` as `last_frame`; the caller may change it'''
+        if boxes is None:
             if self.HD:
-                write_function = self._partial_writeEPD_hd
+                self._full_writeEPD_hd(image)
             else:
-                logging.warning('partial update is not available on non-hd displays')
-                write_function = self._full_writeEPD_non_hd
-
-        else:
+                self._full_writeEPD_non_hd(image)
+            self.partial_count = 0
+        elif boxes:
             if self.HD:
-                write_function = self._full_writeEPD_hd
+                self._partial_writeEPD_hd(image, boxes)
             else:
-                write_function = self._full_writeEPD_non_hd
+                self._partial_writeEPD_non_hd(image)
+            self.partial_count += 1
+        else:
+            logging.debug('no changes since last frame; nothing to write')
+            
+        self.last_frame = image.copy() if keep_copy else image
+    
+    def write_tiles(self, tiles, partial=False, force=False):
+        '''write an image streamed as (box, tile) pieces in panel orientation
         
-        if self.mirror:
-            logging.debug('mirroring output')
-            image = ImageOps.mirror(image)
-
-        write_function(image)
-        if sleep==False:
-            logging.warning('`sleep` kwarg is depricated and no longer used; display will be put to sleep after write')
+        On HD screens each tile is pasted straight into the IT8951 frame buffer, so no 
+        full-frame image is built, transformed or copied. Other screens are small; their 
+        tiles are joined into one image and written with `writeEPD`.
         
+        Partial writes on HD screens refresh the frame buffer with the DU waveform; the 
+        IT8951 driver refreshes only the region that changed. A full refresh is forced
+        after `max_partials` partial refreshes. `dedup` compares a hash of the tiles.
+        
+        Usage:
+            layout = Layout(resolution=screen.resolution, layout=l, transform=screen.transform)
+            screen.write_tiles(layout.tiles())
+        
+        Args:
+            tiles(iterable): ((x0, y0, x1, y1), PIL.Image) pieces, e.g. from `Layout.tiles()`
+            partial(bool): attempt to do a partial refresh (see `writeEPD`)
+            force(bool): write the image even if it is identical to the last frame written
+            
+        Returns:
+            bool: True'''
+        if not self.HD:
+            tiles = list(tiles)
+            size = (max(box[2] for box, tile in tiles), max(box[3] for box, tile in tiles))
+            image = Image.new(self.mode, size, 255)
+            for box, tile in tiles:
+                image.paste(tile, box[:2])
+            return self.writeEPD(image, partial=partial, force=force, transformed=True)
+        
+        with self._spi_lock:
+            if not self.epd:
+                raise UnboundLocalError('no epd is configured')
+            h = hashlib.blake2b(digest_size=16) if self.dedup else None
+            self.bytes_copied = 0
+            try:
+                for box, tile in tiles:
+                    self.epd.frame_buf.paste(tile, box[:2])
+                    self.bytes_copied += tile.width * tile.height
+                    if h:
+                        h.update(f'{box}{tile.mode}'.encode())
+                        h.update(tile.tobytes())
+            except Exception as e:
+                raise ScreenError(f'failed to write image to display: {e}')
+            frame_hash = 'tiles' + h.hexdigest() if h else None
+            
+            if frame_hash and frame_hash == self._last_hash and not force:
+                self.skipped_writes += 1
+                logging.debug(f'frame is identical to last frame written; skipping write ({self.skipped_writes} skipped)')
+                return True
+            
+            self._write_frame_buf_hd(partial)
+            self._last_hash = frame_hash
         return True
     
+    @_spi_handler
+    def _write_frame_buf_hd(self, partial=False):
+        '''refresh an HD screen from the contents of the frame buffer'''
+        try:
+            if partial and self.partial_count < self.max_partials:
+                logging.debug('writing frame buffer using DU (partial display update)')
+                self.epd.draw_partial(self.constants.DisplayModes.DU)
+                self.partial_count += 1
+            else:
+                logging.debug('writing frame buffer using GC16 (full display update)')
+                self.epd.draw_full(self.constants.DisplayModes.GC16)
+                self.partial_count = 0
+        except Exception as e:
+            raise ScreenError(f'failed to write image to display: {e}')
+        # the frame was not kept; the next partial `writeEPD` uses a full refresh
+        self.last_frame = None
+    
+    def write_background(self, image, partial=False, force=False, transformed=False):
+        '''queue an image to be written by a background writer thread
+        
+        The writer thread is started on the first call. Only the most recent frame is kept:
+        a frame that is still waiting when a newer frame is queued is replaced and its future
+        resolves to False. The image is copied (in panel orientation) so it can safely be 
+        changed after queueing.
+        
+        Args:
+            image(PIL image): image to display
+            partial(bool): attempt to do a partial refresh (see `writeEPD`)
+            force(bool): write the image even if it is identical to the last frame written
+            transformed(bool): the image is already in panel orientation (see `writeEPD`)
+            
+        Returns:
+            concurrent.futures.Future: resolves to True when written, False when replaced by a
+                newer frame or dropped at shutdown, or raises the exception from `writeEPD`'''
+        future = Future()
+        image = image.copy() if transformed else self.transform_image(image)
+        with self._writer_cond:
+            if self._writer_stop:
+                raise ScreenError('background writer is stopped')
+            if self._pending:
+                logging.debug('replacing pending frame with newer frame')
+                self._drop_frame(self._pending[2])
+            self._pending = (image, {'partial': partial, 'force': force, 'transformed': True}, future)
+            
+            if not self._writer_thread or not self._writer_thread.is_alive():
+                logging.debug('starting background writer thread')
+                self._writer_thread = threading.Thread(target=self._writer, name='epdlib-writer', daemon=True)
+                self._writer_thread.start()
+            self._writer_cond.notify()
+        return future
+    
+    async def write_async(self, image, partial=False, force=False, transformed=False):
+        '''write an image from a coroutine using the background writer thread
+        
+        Usage: 
+            written = await screen.write_async(image)
+        
+        Args: see `write_background`
+        
+        Returns:
+            bool: True when written, False when replaced by a newer frame'''
+        import asyncio
+        return await asyncio.wrap_future(self.write_background(image, partial=partial, force=force,
+                                                                transformed=transformed))
+    
+    @staticmethod
+    def _drop_frame(future):
+        '''resolve the future of a replaced or dropped frame to False
+        
+        The future may already be cancelled by the caller, e.g. by `asyncio.wait_for()` 
+        timing out on `write_async()`.'''
+        if future.done():
+            return
+        try:
+            future.set_result(False)
+        except InvalidStateError:
+            # cancelled between the check and set_result()
+            pass
+    
+    def _writer(self):
+        '''background writer thread: write the most recent pending frame until stopped'''
+        while True:
+            with self._writer_cond:
+                while self._pending is None and not self._writer_stop:
+                    self._writer_cond.wait()
+                if self._pending is None:
+                    logging.debug('background writer thread stopped')
+                    return
+                image, kwargs, future = self._pending
+                self._pending = None
+            
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(self.writeEPD(image, **kwargs))
+            except Exception as e:
+                logging.error(f'background write failed: {e}')
+                future.set_exception(e)
+                
+    def stop_writer(self, wait=True, timeout=None):
+        '''stop the background writer thread
+        
+        Waits for the frame being written to finish so the display is always left asleep.
+        
+        Args:
+            wait(bool): True: write the pending frame before stopping; False: drop it
+            timeout(float): seconds to wait for the writer thread (None: wait forever)
+            
+        Returns:
+            bool: True if the writer thread has stopped'''
+        with self._writer_cond:
+            self._writer_stop = True
+            if not wait and self._pending:
+                logging.debug('dropping pending frame')
+                self._drop_frame(self._pending[2])
+                self._pending = None
+            self._writer_cond.notify()
+        
+        if self._writer_thread:
+            self._writer_thread.join(timeout)
+            if self._writer_thread.is_alive():
+                logging.warning('background writer thread did not stop before timeout')
+                return False
+            
+        with self._writer_cond:
+            self._writer_thread = None
+            self._writer_stop = False
+        return True
+        
+    @staticmethod
+    def frame_hash(image):
+        '''return a hash of the mode, size and pixel data of an image
+        
+        Args:
+            image(PIL image): image to hash
+            
+        Returns:
+            str: hex digest'''
+        h = hashlib.blake2b(digest_size=16)
+        h.update(f'{image.mode}{image.size}'.encode())
+        h.update(image.tobytes())
+        return h.hexdigest()
+    
+    @staticmethod
+    def diff_boxes(old, new, strip=None):
+        '''find the regions that differ between two images of the same size and mode
+        
+        The images are compared in horizontal strips; runs of changed strips are joined 
+        into one box spanning the changed columns of the run.
+        
+        Args:
+            old(PIL image): previous image
+            new(PIL image): current image
+            strip(int): height of strips in pixels (default: constants.PARTIAL_DIFF_STRIP)
+            
+        Returns:
+            list of (x0, y0, x1, y1) tuples'''
+        if strip is None:
+            strip = constants.PARTIAL_DIFF_STRIP
+        
+        if old.mode == '1':
+            old, new = old.convert('L'), new.convert('L')
+        diff = ImageChops.difference(old, new)
+        if not diff.getbbox():
+            return []
+        
+        width, height = diff.size
+        boxes = []
+        run = None
+        for y in range(0, height, strip):
+            bbox = diff.crop((0, y, width, min(y + strip, height))).getbbox()
+            if bbox:
+                bbox = (bbox[0], bbox[1] + y, bbox[2], bbox[3] + y)
+                if run:
+                    run = (min(run[0], bbox[0]), run[1], max(run[2], bbox[2]), bbox[3])
+                else:
+                    run = bbox
+            elif run:
+                boxes.append(run)
+                run = None
+        if run:
+            boxes.append(run)
+            
+        return boxes
+    
+    def _partial_boxes(self, image):
+        '''choose between a partial and full refresh for `image`
+        
+        Args:
+            image(PIL image): rotated and mirrored image to write
+            
+        Returns:
+            None: a full refresh is required
+            list of (x0, y0, x1, y1): regions to refresh (empty when nothing changed)'''
+        if self.last_frame is None or self.last_frame.size != image.size or self.last_frame.mode != image.mode:
+            logging.debug('no comparable previous frame; using full refresh')
+            return None
+        
+        if self.partial_count >= self.max_partials:
+            logging.debug(f'{self.partial_count} partial refreshes since last full refresh; using full refresh')
+            return None
+        
+        # `displayPartial()` refreshes the whole frame; one bounding box measures the change
+        strip = None if self.HD else image.height
+        boxes = self.diff_boxes(self.last_frame, image, strip=strip)
+        changed = sum((b[2] - b[0]) * (b[3] - b[1]) for b in boxes)/(image.width * image.height)
+        logging.debug(f'{len(boxes)} changed regions covering {changed:.1%} of screen')
+        if changed > self.partial_threshold:
+            logging.debug(f'changed area exceeds partial_threshold ({self.partial_threshold}); using full refresh')
+            return None
+        
+        return boxes
+    
     def _full_writeEPD_hd(self, image):
         '''redraw entire screen, no partial update with waveform GC16
         
             see: https://www.waveshare.net/w/upload/c/c4/E-paper-mode-declaration.pdf for display modes'''
-        # create a blank buffer image to write into
         try:
-            self.epd.frame_buf.paste(0xFF, box=(0, 0, self.resolution[0], self.resolution[1]))
-
-            self.epd.frame_buf.paste(image, [0,0])
-
-
-            self.epd.frame_buf.paste(image, [0, 0])
+            frame_buf = self.epd.frame_buf
+            copied = 0
+            if image.mode != frame_buf.mode:
+                image = image.convert(frame_buf.mode)
+                copied += image.width * image.height
+            if image.size != frame_buf.size:
+                # clear the regions of the frame buffer the image does not cover
+                frame_buf.paste(0xFF, box=(0, 0) + frame_buf.size)
+                copied += frame_buf.width * frame_buf.height
+            # a full resolution 'L' image is copied into the frame buffer exactly once
+            frame_buf.paste(image, (0, 0))
+            self.bytes_copied = copied + image.width * image.height
             logging.debug('writing to display using GC16 (full display update)')
             self.epd.draw_full(self.constants.DisplayModes.GC16)
         except Exception as e:
             raise ScreenError(f'failed to write image to display: {e}')
             
+    def _getbuffer(self, image):
+        '''return the display buffer for an image
+        
+        Images are packed by the driver's `getbuffer()` and compared with the formats in
+        `Pack.FORMATS` until the formats that matched every image of that mode and size 
+        pack all such images identically; simple images such as pure black and white 
+        frames match formats that differ on other images. Later images of that mode and 
+        size are packed by `Pack.pack()`. The driver is always used if no format matches.'''
+        key = (image.mode, image.size)
+        fmt = self._buffer_formats.get(key)
+        width, height = getattr(self.epd, 'width', None), getattr(self.epd, 'height', None)
+        if not self.packed_buffers or fmt is False or not (width and height):
+            return self.epd.getbuffer(image)
+        
+        # None: not compared yet; tuple: formats that matched every image so far
+        if fmt is None or isinstance(fmt, tuple):
+            image_buffer = self.epd.getbuffer(image)
+            matches = Pack.matching_formats(image, image_buffer, width, height, formats=fmt)
+            if len(Pack.distinct_formats(matches, image, width, height)) == 1:
+                self._buffer_formats[key] = matches[0]
+            else:
+                self._buffer_formats[key] = tuple(matches) or False
+            logging.debug(f'buffer format for mode {image.mode} {image.size} images: {self._buffer_formats[key]}')
+            return image_buffer
+        
+        try:
+            return Pack.pack(image, width, height, fmt)
+        except Pack.PackError as e:
+            logging.debug(f'falling back to driver getbuffer(): {e}')
+            return self.epd.getbuffer(image)
+    
     def _full_writeEPD_non_hd(self, image):
         '''wipe screen and write an image'''
-        image_buffer = self.epd.getbuffer(image)
+        image_buffer = self._getbuffer(image)
         
         try:
             if self.one_bit_display: # one bit displays
@@ -654,17 +1116,40 @@ class Screen():
         except Exception as e:
             raise ScreenError(f'failed to write image to display: {e}')
 
-    def _partial_writeEPD_hd(self, image):
+    def _partial_writeEPD_hd(self, image, boxes=None):
         '''partial update, affects only those changed black and white pixels with no flash/wipe
+        
+        Each region is pasted into the frame buffer and refreshed on its own.
 
         uses waveform DU see: see: https://www.waveshare.net/w/upload/c/c4/E-paper-mode-declaration.pdf for display modes
+        
+        Args:
+            image(PIL image): image to write
+            boxes(list of 4-tuple): regions of image to refresh (default: entire image)
         '''
+        if boxes is None:
+            boxes = [(0, 0, image.width, image.height)]
         try:
-            pass
+            self.bytes_copied = 0
+            for box in boxes:
+                logging.debug(f'partial refresh of region: {box}')
+                self.epd.frame_buf.paste(image.crop(box), box[:2])
+                # the region is copied by crop() and by paste()
+                self.bytes_copied += 2 * (box[2] - box[0]) * (box[3] - box[1])
+                self.epd.draw_partial(self.constants.DisplayModes.DU)
+        except Exception as e:
+            raise ScreenError(f'failed to write partial update to display: {e}')
+        
+    def _partial_writeEPD_non_hd(self, image):
+        '''partial update for non HD screens that provide `displayPartial()`
+        
+        The waveshare drivers only support refreshing the whole frame without a flash; the 
+        changed regions are used only to choose between a partial and a full refresh'''
+        image_buffer = self._getbuffer(image)
+        try:
+            self.epd.displayPartial(image_buffer)
         except Exception as e:
             raise ScreenError(f'failed to write partial update to display: {e}')
-        self.epd.frame_buf = image
-        self.epd.draw_partial(self.constants.DisplayModes.DU)
     
     @staticmethod
     def colors2palette(colors=constants.COLORS_7_WS.values(), num_colors=256):
@@ -678,33 +1163,26 @@ class Screen():
         Return:
             palette(list of int): list of integer values for new pallette space'''
         
-        # hard code to RGB
-        mode = 'RGB'
-        
-        # palette is a single list of values
-        palette = []
-        for n in colors:
-            if isinstance(n, str):
-                # convert color string to RGB tuple
-                v = ImageColor.getcolor(n, mode)
-                # append each tuple value to list
-            else:
-                v = n
-            for i in v:
-                palette.append(i)
-        
-        # pad out the palette space with zero values
-        palette = palette + [0, 0, 0] * (num_colors - len(palette)//3)
-        
-        return palette
+        return Palette.get_palette(colors).pil_palette(num_colors)
                                                 
     @staticmethod
     def reduce_palette(image, palette, dither=False):
-        if isinstance(image, str):
-            image = Image.open(image)
-        p = Image.new('P', (1, 1))
-        p.putpalette(palette)
-        return image.convert("RGB").quantize(palette=p, dither=dither)
+        '''reduce an image to a fixed set of colors
+        
+        The nearest color lookup table and recently reduced images are cached for each palette.
+        
+        Args:
+            image(PIL.Image or str): image or path to image
+            palette(list of int): palette generated by `colors2palette()`
+            dither(bool or str): False: nearest color; True or 'floydsteinberg': Floyd-Steinberg;
+                'atkinson': Atkinson; 'bayer': ordered dithering (see `Palette.DITHERS`)
+                
+        Returns:
+            PIL.Image: 'P' mode image'''
+        if not isinstance(dither, str):
+            dither = 'floydsteinberg' if dither else None
+        colors = [tuple(palette[i:i+3]) for i in range(0, len(palette), 3)]
+        return Palette.get_palette(colors).reduce(image, dither=dither)
         
         
     
@@ -732,6 +1210,7 @@ class Screen():
         if self.HD:
             pass
         else:
+            from gpiozero import GPIODeviceError
             # self.epd.module_exit(cleanup=True)
             logging.info('shutting down epd interface')
             try:
@@ -742,6 +1221,200 @@ class Screen():
                 raise ScreenError(e)
 
 
+register_driver('HD', Screen._load_hd, hd=True)
+for name, config in constants.VIRTUAL_PANELS.items():
+    register_driver(name, VirtualEPD.loader(**config))
+
+
+# + code_folding=[0]
+_panel_index = None
+
+
+def _waveshare_signature():
+    '''identify the installed waveshare_epd package: distribution version and the
+    location and modification time of the package directories'''
+    import waveshare_epd
+    try:
+        from importlib import metadata
+    except ImportError:
+        # python 3.7; the package paths and modification times still identify the install
+        try:
+            import importlib_metadata as metadata
+        except ImportError:
+            metadata = None
+    
+    version = None
+    if metadata is not None:
+        try:
+            version = metadata.version('waveshare-epd')
+        except metadata.PackageNotFoundError:
+            pass
+        
+    paths = []
+    for path in waveshare_epd.__path__:
+        try:
+            mtime = Path(path).stat().st_mtime
+        except OSError:
+            mtime = None
+        paths.append([str(path), mtime])
+    return {'version': version, 'paths': paths}
+
+
+def _probe_panel(name):
+    '''import waveshare_epd.`name` and record its capabilities
+    
+    Returns:
+        dict: name, error, resolution, mode, one_bit_display, colors ('1bit', 'bicolor' or '7color'),
+            clear_params, clear_args, display_args, display_arity'''
+    import inspect
+    from importlib import import_module
+    
+    logging.debug(f'probing capabilities of waveshare_epd.{name}')
+    panel = {'name': name,
+             'error': None,
+             'resolution': None,
+             'mode': None,
+             'one_bit_display': None,
+             'colors': None,
+             'clear_params': None,
+             'clear_args': {},
+             'display_args': None,
+             'display_arity': None}
+    
+    try:
+        myepd = import_module(f'waveshare_epd.{name}')
+    except ModuleNotFoundError as e:
+        panel['error'] = f'ModuleNotFound: {e}'
+        return panel
+    except Exception as e:
+        panel['error'] = f'General Exception: {e}'
+        return panel
+
+    # check for supported `Clear()` function
+    try:
+        panel['clear_params'] = inspect.getfullargspec(myepd.EPD.Clear).args
+        color_default = inspect.signature(myepd.EPD.Clear).parameters.get('color', False)
+    except AttributeError:
+        color_default = False
+    # it appears that not all of the older waveshare epd screens have
+    # a default `color` parameter. For those use constants.CLEAR_COLOR (0xFF)
+    if color_default and color_default.default is color_default.empty:
+        panel['clear_args']['color'] = constants.CLEAR_COLOR
+
+    # check for "standard" `display()` function
+    try:
+        panel['display_args'] = inspect.getfullargspec(myepd.EPD.display).args
+        panel['display_arity'] = len(panel['display_args'])
+    except AttributeError:
+        pass
+    
+    try:
+        resolution = [myepd.EPD_HEIGHT, myepd.EPD_WIDTH]
+        resolution.sort(reverse=True)
+        panel['resolution'] = resolution
+    except AttributeError:
+        pass
+    
+    try:
+        properties = vars(myepd.EPD())
+    except Exception as e:
+        panel['error'] = f'General Exception: {e}'
+        return panel
+    
+    # 2 and 3 color displays have >= 2 args
+    one_bit_display = panel['display_arity'] is not None and panel['display_arity'] <= 2
+    # use the presence of `BLUE` and `ORANGE` properties as evidence that this is a color display
+    if properties.get('BLUE', False) and properties.get('ORANGE', False):
+        panel['colors'] = '7color'
+        panel['one_bit_display'] = False
+        panel['mode'] = 'RGB'
+    else:
+        panel['colors'] = '1bit' if one_bit_display else 'bicolor'
+        panel['one_bit_display'] = one_bit_display
+        panel['mode'] = '1'
+    return panel
+
+
+def _write_panel_index(index):
+    '''write the panel index to constants.PANEL_INDEX_FILE'''
+    index_file = constants.PANEL_INDEX_FILE
+    try:
+        index_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = index_file.with_suffix('.tmp')
+        with open(tmp_file, 'w') as f:
+            json.dump(index, f)
+        tmp_file.replace(index_file)
+    except OSError as e:
+        logging.warning(f'could not write panel index {index_file}: {e}')
+    else:
+        logging.debug(f'wrote panel index: {index_file}')
+        
+
+def panel_index(refresh=False):
+    '''return the capability index of the installed waveshare_epd modules
+    
+    The index is read from `constants.PANEL_INDEX_FILE` once per process and is
+    rebuilt when the waveshare_epd package version or location changes. Modules
+    are probed and added the first time they are requested with `panel_capabilities()`.
+    
+    Args:
+        refresh(bool): discard the index and rebuild it
+        
+    Returns:
+        dict: {'signature': dict, 'modules': [module names], 'panels': {name: capabilities}}'''
+    global _panel_index
+    if _panel_index is not None and not refresh:
+        return _panel_index
+    
+    import pkgutil
+    import waveshare_epd
+    
+    signature = _waveshare_signature()
+    index = None
+    if not refresh:
+        try:
+            with open(constants.PANEL_INDEX_FILE, 'r') as f:
+                index = json.load(f)
+        except FileNotFoundError:
+            logging.debug(f'no panel index: {constants.PANEL_INDEX_FILE}')
+        except (OSError, ValueError) as e:
+            logging.warning(f'could not read panel index {constants.PANEL_INDEX_FILE}: {e}')
+            
+    if not isinstance(index, dict) or index.get('signature') != signature:
+        logging.debug('building waveshare_epd panel index')
+        index = {'signature': signature,
+                 'modules': sorted(i.name for i in pkgutil.iter_modules(waveshare_epd.__path__)),
+                 'panels': {}}
+        _write_panel_index(index)
+        
+    _panel_index = index
+    return index
+
+
+def panel_capabilities(epd):
+    '''return the capabilities of a waveshare_epd module from the panel index
+    
+    Modules that are not in the index yet are probed and added to the index.
+    
+    Args:
+        epd(str): name of waveshare_epd module
+        
+    Returns:
+        dict: see `_probe_panel()` or None if there is no such module'''
+    index = panel_index()
+    if epd not in index['modules']:
+        return None
+    if epd in index['panels']:
+        return index['panels'][epd]
+    
+    panel = _probe_panel(epd)
+    # failures may be transient (missing dependencies, GPIO in use); probe these again next time
+    if not panel['error']:
+        index['panels'][epd] = panel
+        _write_panel_index(index)
+    return panel
+
+
 # + code_folding=[]
 def list_compatible_modules(print_modules=True, reasons=False):
     '''list compatible waveshare EPD modules
@@ -749,65 +1422,49 @@ def list_compatible_modules(print_modules=True, reasons=False):
         This list includes only modules provided by the waveshare-epd git repo
         and does **NOT** include HD IT8951 based panels'''
     
-    import pkgutil
-    import waveshare_epd
-    import inspect
-    from importlib import import_module
-    
+    index = panel_index()
 
     panels = []
-    for i in pkgutil.iter_modules(waveshare_epd.__path__):
-
-        supported = True
-        display_args = []
-        clear_args = []
-        reason = []
-        if not 'epd' in i.name or 'epdconfig' in i.name:
+    for name in index['modules']:
+        if not 'epd' in name or 'epdconfig' in name:
             continue
-            
-        try:
-            myepd = import_module(f'waveshare_epd.{i.name}')                
         
-        except ModuleNotFoundError:
-            reason.append(f'ModuleNotFound: {i.name}')
-            myepd = None
-        except Exception as e:
-            reason.append(f'General Exception: {e}')
-            myepd = None
+        panel = panel_capabilities(name)
+        supported = True
+        reason = []
+        if panel['error']:
+            supported = False
+            reason.append(panel['error'])
             
-        try:
-            if vars(myepd.EPD()).get('GREEN', False):
-                mode = '"RGB" 7 Color'
-            else:
-                mode = '"1" 1 bit'
-        except AttributeError as e:
+        if panel['colors'] == '7color':
+            mode = '"RGB" 7 Color'
+        elif panel['colors']:
+            mode = '"1" 1 bit'
+        else:
             mode = 'Unsupported'
-            
         
-        try:
-            clear_args_spec = inspect.getfullargspec(myepd.EPD.Clear)
-            clear_args = clear_args_spec.args
-            if len(clear_args) > 2:
-                supported = False
-                reason.append('Non-standard, unsupported `EPD.Clear()` function')
-                mode = 'Unsupported'
-        except AttributeError:
+        if panel['clear_params'] is None:
             supported = False
             mode = 'Unsupported'
             reason.append('AttributeError: module does not support `EPD.Clear()`')
+        elif len(panel['clear_params']) > 2:
+            supported = False
+            reason.append('Non-standard, unsupported `EPD.Clear()` function')
+            mode = 'Unsupported'
             
-        try:
-            display_args_spec = inspect.getfullargspec(myepd.EPD.display)
-            display_args = display_args_spec.args
-        except AttributeError:
+        if panel['display_arity'] is None:
             supported = False
             reason.append('AttributeError: module does not support standard `EPD.display()`')
             mode = 'Unsupported'
+            
+        if panel['resolution'] is None and not panel['error']:
+            supported = False
+            reason.append('AttributeError: module does not define `EPD_WIDTH` and `EPD_HEIGHT`')
+            mode = 'Unsupported'
 
-
-        panels.append({'name': i.name, 
-                       'clear_args': clear_args, 
-                       'display_args': display_args,
+        panels.append({'name': name, 
+                       'clear_args': panel['clear_params'] or [], 
+                       'display_args': panel['display_args'] or [],
                        'supported': supported,
                        'reason': reason,
                        'mode': mode})
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''type enforcement decorators shared by Block, Layout and Screen
+
+Setters are decorated with `strict_enforce()` (raise TypeError on a wrong type) or
+`permissive_enforce()` (convert the value to the type):
+    @font_size.setter
+    @strict_enforce(int)
+    def font_size(self, font_size):
+        ...
+
+Trusted mode removes `strict_enforce()` checks when the classes are defined, so a
+decorated setter costs the same as an undecorated one. Values are not checked in
+trusted mode; use it for tested, production code. Trusted mode is enabled only by
+setting the environment variable `EPDLIB_TRUSTED=1` before epdlib is imported;
+`python -O` does not enable it. `permissive_enforce()` converts values and is not 
+removed.
+'''
+
+import logging
+import os
+from functools import wraps
+
+
+def _trusted():
+    return os.environ.get('EPDLIB_TRUSTED', '').lower() not in ('', '0', 'false', 'no')
+
+
+# read when a setter is decorated; changing it later does not affect classes already defined
+TRUSTED = _trusted()
+if TRUSTED:
+    logging.debug('epdlib trusted mode: type checks are disabled')
+
+
+def strict_enforce(*types):
+    """decorator: strictly enforce type compliance within classes
+
+    The decorator returns the undecorated function in trusted mode (see `TRUSTED`).
+
+    Usage:
+    @strict_enforce(type1, type2, (type3, type4))
+    def foo(self, val1, val2, val3):
+        ...
+    """
+    def decorator(f):
+        if TRUSTED:
+            return f
+
+        if len(types) == 1:
+            # setters take a single value; skip building and zipping the argument tuples
+            t = types[0]
+
+            @wraps(f)
+            def new_f(self, value, *args, **kwds):
+                if not isinstance(value, t):
+                    raise TypeError(f'"{value}" is not type {t}')
+                return f(self, value, *args, **kwds)
+            return new_f
+
+        @wraps(f)
+        def new_f(self, *args, **kwds):
+            for (a, t) in zip(args, types):
+                if not isinstance(a, t):
+                    raise TypeError(f'"{a}" is not type {t}')
+            return f(self, *args, **kwds)
+        return new_f
+    return decorator
+
+
+def permissive_enforce(*types):
+    """decorator: convert arguments to the given types within classes
+
+    Allows similar types:
+        for int: 0, 0.1
+        for bool: 0, 1, 'some string', False, True
+        for string: 7, 66, '77', 'some string', False, True
+
+    Values that are already of the exact type are passed through unchanged.
+
+    Usage:
+    @permissive_enforce(type1, type2, typeN)
+    def foo(self, val1, val2, valN):
+        ...
+    """
+    def decorator(f):
+        if len(types) == 1:
+            t = types[0]
+
+            @wraps(f)
+            def new_f(self, value, *args, **kwds):
+                if value.__class__ is not t:
+                    value = t(value)
+                return f(self, value, *args, **kwds)
+            return new_f
+
+        @wraps(f)
+        def new_f(self, *args, **kwds):
+            newargs = [t(a) for (a, t) in zip(args, types)]
+            newargs.extend(args[len(newargs):])
+            return f(self, *newargs, **kwds)
+        return new_f
+    return decorator
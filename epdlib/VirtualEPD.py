@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''virtual e-paper panels for running and timing Screen objects without hardware
+
+`VirtualEPD` emulates a waveshare_epd `EPD` object and `VirtualHDEPD` emulates an
+IT8951 `AutoEPDDisplay`. Both sleep for the configured waveform duration on each
+refresh and keep a log of refreshes so the render-to-write pipeline can be
+load-tested and timed.
+
+The panels in `constants.VIRTUAL_PANELS` are registered as Screen drivers:
+    s = Screen(epd='virtual_hd')
+'''
+
+import logging
+import time
+from types import SimpleNamespace
+from PIL import Image
+
+try:
+    from . import constants
+except ImportError as e:
+    import constants
+
+
+logger = logging.getLogger(__name__)
+
+
+class VirtualEPD:
+    '''emulation of a waveshare_epd `EPD` object'''
+    def __init__(self, resolution=(800, 480), mode='1', full_refresh=0, partial_refresh=0,
+                 fast_refresh=0, **kwargs):
+        '''create a virtual waveshare panel
+
+        Args:
+            resolution(tuple of int): width, height of panel in pixels
+            mode(str): '1' for black and white panels, 'RGB' for 7-color panels
+            full_refresh(float): seconds taken by `display()` and `Clear()`
+            partial_refresh(float): seconds taken by `displayPartial()`
+            fast_refresh(float): seconds taken by `display_fast()`
+
+        Properties:
+            refreshes(list of tuple): (waveform, seconds) for each refresh
+            inits(list of str): 'full' for each `init()`, 'partial' for each `init_part()`
+            buffer(bytearray): last buffer written to the panel
+            awake(bool): True between `init()` and `sleep()`'''
+        if mode not in ('1', 'RGB'):
+            raise ValueError(f'virtual waveshare panels support mode "1" or "RGB": {mode}')
+        self.width, self.height = resolution
+        self.mode = mode
+        self.full_refresh = full_refresh
+        self.partial_refresh = partial_refresh
+        self.fast_refresh = fast_refresh
+        self.refreshes = []
+        self.inits = []
+        self.buffer = None
+        self.awake = False
+        self.palette = list(constants.COLORS_7_WS.values())
+        if mode == 'RGB':
+            # 7-color panels expose their colors as properties
+            for idx, name in enumerate(constants.COLORS_7_WS):
+                setattr(self, name, idx)
+
+    def _refresh(self, waveform, seconds):
+        if not self.awake:
+            logging.warning('virtual panel written while asleep')
+        time.sleep(seconds)
+        self.refreshes.append((waveform, seconds))
+
+    def init(self):
+        self.awake = True
+        self.inits.append('full')
+        return 0
+
+    def init_part(self):
+        self.awake = True
+        self.inits.append('partial')
+        return 0
+
+    def sleep(self):
+        self.awake = False
+
+    def getbuffer(self, image):
+        '''pack an image into the panel buffer format
+
+        Portrait images are rotated to landscape like the waveshare drivers.
+        '1': 1 bit per pixel, MSB first, 1 is white
+        'RGB': 4 bits per pixel palette index, high nibble first
+
+        Returns:
+            bytearray'''
+        if image.size == (self.height, self.width) and self.width != self.height:
+            image = image.rotate(90, expand=True)
+        if image.size != (self.width, self.height):
+            raise ValueError(f'image size {image.size} does not match panel {self.width}x{self.height}')
+
+        if self.mode == '1':
+            return bytearray(image.convert('1').tobytes())
+
+        palette = Image.new('P', (1, 1))
+        palette.putpalette([v for color in self.palette for v in color] + [0, 0, 0] * (256 - len(self.palette)))
+        indexes = image.convert('RGB').quantize(palette=palette, dither=Image.Dither.NONE).tobytes()
+        return bytearray((indexes[i] << 4) | indexes[i+1] for i in range(0, len(indexes), 2))
+
+    @property
+    def image(self):
+        '''PIL.Image: decoded contents of the last buffer written to the panel'''
+        if self.buffer is None:
+            return None
+        if self.mode == '1':
+            return Image.frombytes('1', (self.width, self.height), bytes(self.buffer))
+        indexes = bytearray()
+        for byte in self.buffer:
+            indexes.append(byte >> 4)
+            indexes.append(byte & 0x0F)
+        image = Image.frombytes('P', (self.width, self.height), bytes(indexes))
+        image.putpalette([v for color in self.palette for v in color])
+        return image.convert('RGB')
+
+    def display(self, image_buffer):
+        self.buffer = image_buffer
+        self._refresh('full', self.full_refresh)
+
+    def displayPartial(self, image_buffer):
+        self.buffer = image_buffer
+        self._refresh('partial', self.partial_refresh)
+
+    def display_fast(self, image_buffer):
+        self.buffer = image_buffer
+        self._refresh('fast', self.fast_refresh)
+
+    def Clear(self, color=constants.CLEAR_COLOR):
+        self.buffer = self.getbuffer(Image.new(self.mode, (self.width, self.height), 'white'))
+        self._refresh('clear', self.full_refresh)
+
+
+class VirtualHDEPD:
+    '''emulation of an IT8951 `AutoEPDDisplay` object'''
+    def __init__(self, resolution=(1872, 1404), full_refresh=0, partial_refresh=0, fast_refresh=0,
+                 **kwargs):
+        '''create a virtual IT8951 panel
+
+        Args:
+            resolution(tuple of int): width, height of panel in pixels
+            full_refresh(float): seconds taken by a GC16/GL16 refresh and `clear()`
+            partial_refresh(float): seconds taken by a DU refresh
+            fast_refresh(float): seconds taken by an A2 refresh
+
+        Properties:
+            frame_buf(PIL.Image): 8 bit frame buffer
+            refreshes(list of tuple): (waveform, seconds) for each refresh
+            awake(bool): True between `epd.run()` and `epd.sleep()`'''
+        self.display_dims = tuple(resolution)
+        self.width, self.height = resolution
+        self.frame_buf = Image.new('L', self.display_dims, 0xFF)
+        self.prev_frame = None
+        self.refreshes = []
+        self.awake = False
+        self.durations = {constants.VIRTUAL_HD_DISPLAY_MODES['INIT']: full_refresh,
+                          constants.VIRTUAL_HD_DISPLAY_MODES['GC16']: full_refresh,
+                          constants.VIRTUAL_HD_DISPLAY_MODES['GL16']: full_refresh,
+                          constants.VIRTUAL_HD_DISPLAY_MODES['GLR16']: full_refresh,
+                          constants.VIRTUAL_HD_DISPLAY_MODES['GLD16']: full_refresh,
+                          constants.VIRTUAL_HD_DISPLAY_MODES['DU']: partial_refresh,
+                          constants.VIRTUAL_HD_DISPLAY_MODES['DU4']: partial_refresh,
+                          constants.VIRTUAL_HD_DISPLAY_MODES['A2']: fast_refresh}
+        self.epd = SimpleNamespace(run=self._run, sleep=self._sleep,
+                                   spi=SimpleNamespace(__del__=lambda: None))
+
+    def _run(self):
+        self.awake = True
+
+    def _sleep(self):
+        self.awake = False
+
+    def _refresh(self, mode):
+        if not self.awake:
+            logging.warning('virtual panel written while asleep')
+        seconds = self.durations.get(mode, 0)
+        time.sleep(seconds)
+        self.refreshes.append((mode, seconds))
+        self.prev_frame = self.frame_buf.copy()
+
+    @property
+    def image(self):
+        '''PIL.Image: contents of the panel after the last refresh'''
+        return self.prev_frame
+
+    def draw_full(self, mode):
+        self._refresh(mode)
+
+    def draw_partial(self, mode):
+        self._refresh(mode)
+
+    def clear(self):
+        self.frame_buf.paste(0xFF, box=(0, 0, self.width, self.height))
+        self._refresh(constants.VIRTUAL_HD_DISPLAY_MODES['INIT'])
+
+
+def loader(**config):
+    '''return a Screen driver loader for a virtual panel
+
+    Usage:
+        register_driver('my_panel', VirtualEPD.loader(resolution=(400, 300), mode='1'))
+        s = Screen(epd='my_panel')
+
+    Args:
+        config: kwargs for VirtualEPD or VirtualHDEPD; `hd=True` for an IT8951 panel
+
+    Returns:
+        function(screen, epd) that returns an epd configuration dictionary'''
+    config = dict(config)
+    hd = config.pop('hd', False)
+
+    def load(screen, epd):
+        logging.debug(f'configuring virtual epd "{epd}": {config}')
+        if hd:
+            myepd = VirtualHDEPD(**config)
+            mode = 'L'
+            display_constants = SimpleNamespace(DisplayModes=SimpleNamespace(**constants.VIRTUAL_HD_DISPLAY_MODES))
+        else:
+            myepd = VirtualEPD(**config)
+            mode = myepd.mode
+            display_constants = None
+        resolution = sorted([myepd.width, myepd.height], reverse=True)
+        return {'epd': myepd,
+                'resolution': resolution,
+                'clear_args': {},
+                'one_bit_display': mode == '1',
+                'constants': display_constants,
+                'mode': mode}
+
+    load.hd = hd
+    return load
@@ -6,5 +6,5 @@ from .version import __version__
 from .Block import TextBlock
 from .Block import ImageBlock
 from .Layout import Layout
-from .Screen import Screen, ScreenShot, Update, list_compatible_modules
+from .Screen import Screen, ScreenShot, Update, list_compatible_modules, register_driver
 
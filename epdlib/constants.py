@@ -2,6 +2,7 @@
 #!/usr/bin/env python
 # coding: utf-8
 
+import os
 from pathlib import Path
 
 #FONT = str(Path('./fonts/Open_Sans/OpenSans-Regular.ttf').resolve())
@@ -12,6 +13,16 @@ MODES = {'1': '1 bit', 'L': '8 bit', 'RGB': 'Red, Green, Blue'}
 
 SCREEN_ROTATIONS = [0, 90, -90, 180, 270]
 
+# single PIL.Image.Transpose operation equal to rotating by (rotation, expand=True) then 
+# mirroring (left to right) for each (rotation, mirror) pair; None: no transform
+SCREEN_TRANSFORMS = {
+    (0, False): None, (0, True): 'FLIP_LEFT_RIGHT',
+    (90, False): 'ROTATE_90', (90, True): 'TRANSVERSE',
+    (-90, False): 'ROTATE_270', (-90, True): 'TRANSPOSE',
+    (180, False): 'ROTATE_180', (180, True): 'FLIP_TOP_BOTTOM',
+    (270, False): 'ROTATE_270', (270, True): 'TRANSPOSE',
+}
+
 
 COLORS_7_WS = {
     'BLACK':  (0, 0, 0),
@@ -23,8 +34,41 @@ COLORS_7_WS = {
     'ORANGE': (255, 128, 0)
 }
 
+# colors of the waveshare 4 color (black, white, yellow, red) panels in palette order
+COLORS_4_WS = {
+    'BLACK':  (0, 0, 0),
+    'WHITE':  (255, 255, 255),
+    'YELLOW': (255, 255, 0),
+    'RED':    (255, 0, 0)
+}
+
 CLEAR_COLOR = 0xFF
 
+# fraction of the screen area that may change before a partial refresh is promoted to a full refresh
+PARTIAL_REFRESH_THRESHOLD = 0.5
+# number of consecutive partial refreshes before a full refresh is forced to clear ghosting
+PARTIAL_REFRESH_MAX = 10
+# height in pixels of the horizontal strips used for finding changed regions between frames
+PARTIAL_DIFF_STRIP = 16
+# height in pixels of the bands yielded by Layout.tiles() and streamed by Screen.write_tiles()
+TILE_HEIGHT = 128
+
+# persisted capabilities of the waveshare_epd modules; rebuilt when waveshare_epd changes
+PANEL_INDEX_FILE = Path(os.environ.get('XDG_CACHE_HOME', '~/.cache')).expanduser()/'epdlib'/'panel_index.json'
+
+# IT8951 display modes (waveforms) used by VirtualEPD.VirtualHDEPD
+VIRTUAL_HD_DISPLAY_MODES = {'INIT': 0, 'DU': 1, 'GC16': 2, 'GL16': 3, 'GLR16': 4, 'GLD16': 5, 'DU4': 6, 'A2': 7}
+
+# virtual panels registered as Screen drivers; refresh times in seconds
+VIRTUAL_PANELS = {
+    'virtual': {'resolution': (800, 480), 'mode': '1', 
+                'full_refresh': 4.0, 'partial_refresh': 0.4, 'fast_refresh': 1.5},
+    'virtual_7color': {'resolution': (600, 448), 'mode': 'RGB', 
+                       'full_refresh': 12.0, 'partial_refresh': 12.0, 'fast_refresh': 12.0},
+    'virtual_hd': {'resolution': (1872, 1404), 'hd': True, 
+                   'full_refresh': 0.45, 'partial_refresh': 0.26, 'fast_refresh': 0.12},
+}
+
 LAYOUT_DEFAULTS = {
 #                    'type': None,
 #                    'image': None,
@@ -89,6 +133,21 @@ BLOCK_ADD_BORDER_DEFAULTS = {'fill': None,
 
 LAYOUT_SCALE_FONT_TEXT = '9QqMm'
 
+# maximum number of layout cache files to keep in a `Layout` cache_dir; least recently used files are removed
+LAYOUT_CACHE_FILES = 16
+
+# maximum number of ImageFont.truetype objects (unique font path + size) to keep in the font cache
+FONT_CACHE_SIZE = 256
+
+# maximum number of wrapped texts and fitted font sizes to keep for measured text fitting
+TEXT_FIT_CACHE_SIZE = 256
+
+# maximum number of word-wrapped texts (unique text + maxchar + max_lines) to keep
+TEXT_WRAP_CACHE_SIZE = 256
+
+# maximum number of rendered text images (unique text + font + size + colors + mode + align) to keep
+TEXT_IMAGE_CACHE_SIZE = 64
+
 
 DRAW_SHAPES = ['rectangle', 'rounded_rectangle', 'ellipse']
 
@@ -944,3 +1003,10 @@ DAN_CHARDIST = {
 }
 
 
+
+# bits per channel of the nearest-color lookup table used by Palette (6: 262144 entries)
+PALETTE_LUT_BITS = 6
+# number of reduced images cached by each Palette
+PALETTE_CACHE_SIZE = 8
+# amplitude of the Bayer threshold matrix used for ordered dithering by Palette
+PALETTE_BAYER_SPREAD = 192
@@ -27,6 +27,7 @@ setuptools.setup(
         "Operating System :: OS Independent"],
     keywords="graphics e-paper display waveshare",
     install_requires=["Pillow", "spidev", "RPi.GPIO", "gpiozero", "lgpio"],
+    extras_require={"numpy": ["numpy"]},
     project_urls={"Source": "https://github.com/txoof/epdlib"},
     python_requires=">=3.7",
     package_data={"documentation": ["./docs"]},
@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+'''benchmark the Block, Layout and Screen hot paths
+
+Run all benchmarks and print the results:
+    $ python utilities/benchmark.py
+
+Save the results as JSON for later comparison:
+    $ python utilities/benchmark.py --output before.json
+
+Compare against a saved run; exits with status 1 if any benchmark is slower
+than the baseline by more than the threshold (default 10%):
+    $ python utilities/benchmark.py --compare before.json --threshold 0.1
+
+Run only some benchmarks (substring match on the name):
+    $ python utilities/benchmark.py --filter layout --filter concat
+
+The Screen benchmarks use virtual IT8951 and waveshare panels with no refresh
+delay, so no hardware is needed.
+'''
+
+import argparse
+import json
+import logging
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from PIL import Image
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from epdlib import Block, Layout, Screen, VirtualEPD, register_driver
+from epdlib import Pack, Palette, Validate
+from epdlib import version
+
+FONT = str(ROOT / 'fonts/Open_Sans/OpenSans-Regular.ttf')
+IMAGE = str(ROOT / 'images/portrait-pilot_SW0YN0Z5T0.jpg')
+
+RESOLUTIONS = [(250, 122), (800, 480), (1872, 1404)]
+
+# multi-section layout similar to a weather/news dashboard
+LAYOUT = {
+    'title': {'type': 'TextBlock', 'width': 1, 'height': .15, 'abs_coordinates': (0, 0),
+              'max_lines': 1, 'font': FONT, 'hcenter': True, 'vcenter': True},
+    'body': {'type': 'TextBlock', 'width': .6, 'height': .55, 'abs_coordinates': (0, None),
+             'relative': ['body', 'title'], 'max_lines': 4, 'font': FONT, 'padding': 5},
+    'image': {'type': 'ImageBlock', 'width': .4, 'height': .55, 'abs_coordinates': (None, None),
+              'relative': ['body', 'title'], 'hcenter': True, 'vcenter': True},
+    'footer_left': {'type': 'TextBlock', 'width': .5, 'height': .3, 'abs_coordinates': (0, None),
+                    'relative': ['footer_left', 'body'], 'max_lines': 2, 'font': FONT,
+                    'fill': 'WHITE', 'bkground': 'BLACK'},
+    'footer_right': {'type': 'DrawBlock', 'width': .5, 'height': .3, 'abs_coordinates': (None, None),
+                     'relative': ['footer_left', 'body'], 'shape': 'rounded_rectangle',
+                     'draw_format': {'radius': 10, 'outline': 0, 'width': 3}, 'scale_x': .8, 'scale_y': .8},
+}
+
+UPDATE = {'title': 'Benchmark Title',
+          'body': 'The quick brown fox jumps over the lazy dog while the spam, spam, spam and eggs cook',
+          'image': IMAGE,
+          'footer_left': '21°C and sunny',
+          'footer_right': True}
+
+
+# virtual panels with no refresh delay
+register_driver('benchmark_hd', VirtualEPD.loader(resolution=(1872, 1404), hd=True))
+register_driver('benchmark_1bit', VirtualEPD.loader(resolution=(800, 480), mode='1'))
+
+
+def mock_screen(hd):
+    '''return a Screen bound to a virtual HD or one-bit driver'''
+    return Screen(epd='benchmark_hd' if hd else 'benchmark_1bit', rotation=0)
+
+
+def benchmarks(tmp_dir):
+    '''return a dict of {name: (setup, function)}; setup() returns the argument for function()'''
+    large_jpeg = str(Path(tmp_dir) / 'large.jpg')
+    Image.open(IMAGE).resize((3840, 5376)).save(large_jpeg, quality=90)
+
+    cases = {}
+
+    # cold start in a fresh interpreter; compare with `python_startup` for the cost of the import
+    for name, code in (('python_startup', 'pass'), ('import_epdlib', 'import epdlib')):
+        def cold_start(_, code=code):
+            subprocess.run([sys.executable, '-c', code], cwd=ROOT, check=True)
+        cases[name] = (lambda: None, cold_start)
+
+    def textblock_create():
+        Block.TextBlock(area=(400, 100), font=FONT, font_size=24, max_lines=2, text='spam, spam, spam & ham')
+    cases['textblock_create'] = (lambda: None, lambda _: textblock_create())
+
+    # cost of the type enforcement decorators on a setter; `setter_trusted` is what the
+    # setters compile to in trusted mode (EPDLIB_TRUSTED=1)
+    def store(self, value):
+        self._value = value
+    setters = {'setter_trusted_x1000': store,
+               'setter_strict_enforce_x1000': Validate.strict_enforce(str)(store),
+               'setter_permissive_enforce_x1000': Validate.permissive_enforce(str)(store)}
+    for name, setter in setters.items():
+        def setter_setup(setter=setter):
+            return type('Setter', (), {'value': property(None, setter)})()
+        def set_value(obj):
+            for _ in range(1000):
+                obj.value = 'spam'
+        cases[name] = (setter_setup, set_value)
+
+    def textblock_update_setup():
+        return [Block.TextBlock(area=(400, 100), font=FONT, font_size=24, max_lines=2), 0]
+    def textblock_update(state):
+        state[1] += 1
+        state[0].update(f'spam, spam, spam & ham {state[1]}')
+    cases['textblock_update'] = (textblock_update_setup, textblock_update)
+
+    # rotating displays cycle through a fixed set of messages
+    def textblock_rotate(state):
+        state[1] += 1
+        state[0].update(f'spam, spam, spam & ham {state[1] % 5}')
+    cases['textblock_update_rotating'] = (textblock_update_setup, textblock_rotate)
+
+    for resolution in RESOLUTIONS:
+        tag = f'{resolution[0]}x{resolution[1]}'
+
+        def layout_build(_, resolution=resolution):
+            Block.clear_font_cache()
+            Layout(resolution=resolution, layout=LAYOUT, mode='L')
+        cases[f'layout_build_{tag}'] = (lambda: None, layout_build)
+
+        section = {'font': FONT, 'max_lines': 2, 'padded_area': (resolution[0], int(resolution[1]*.3))}
+        def scale_font(_, section=section):
+            Block.clear_font_cache()
+            Layout._scale_font(section)
+        cases[f'layout_scale_font_{tag}'] = (lambda: None, scale_font)
+
+        def concat_setup(resolution=resolution):
+            layout = Layout(resolution=resolution, layout=LAYOUT, mode='L')
+            layout.update_contents(UPDATE)
+            return [layout, 0]
+        def concat(state):
+            state[1] += 1
+            state[0].update_contents({'footer_left': f'{state[1]}°C and sunny'})
+            state[0].concat()
+        cases[f'layout_update_concat_{tag}'] = (concat_setup, concat)
+
+    def imageblock_large_jpeg_setup():
+        return Block.ImageBlock(area=(936, 1404), mode='L', hcenter=True, vcenter=True)
+    def imageblock_large_jpeg(block):
+        block.image = large_jpeg
+    cases['imageblock_large_jpeg'] = (imageblock_large_jpeg_setup, imageblock_large_jpeg)
+
+    # 7-color palette reduction; Pillow's quantize() is the baseline
+    for resolution in ((600, 448), (1600, 1200)):
+        tag = f'{resolution[0]}x{resolution[1]}'
+        def palette_setup(resolution=resolution):
+            palette = Palette.get_palette()
+            palette.lut
+            return palette, Image.open(IMAGE).convert('RGB').resize(resolution)
+        def pillow_quantize(state):
+            p = Image.new('P', (1, 1))
+            p.putpalette(Screen.colors2palette())
+            state[1].quantize(palette=p, dither=Image.Dither.NONE)
+        cases[f'palette_pillow_quantize_{tag}'] = (palette_setup, pillow_quantize)
+        for dither in Palette.DITHERS:
+            def palette_reduce(state, dither=dither):
+                state[0].reduce(state[1], dither=dither, cache=False)
+            cases[f'palette_reduce_{str(dither).lower()}_{tag}'] = (palette_setup, palette_reduce)
+
+    # native panel buffers packed by epdlib
+    for fmt, resolution, mode in (('1bpp', (800, 480), '1'), ('4bpp_7color', (600, 448), 'RGB')):
+        def pack_setup(resolution=resolution, mode=mode):
+            return Image.open(IMAGE).convert(mode).resize(resolution)
+        def pack(image, fmt=fmt, resolution=resolution):
+            Pack.pack(image, *resolution, fmt)
+        cases[f'pack_{fmt}_{resolution[0]}x{resolution[1]}'] = (pack_setup, pack)
+
+    for name, hd in (('screen_write_hd', True), ('screen_write_1bit', False)):
+        def screen_setup(hd=hd):
+            screen = mock_screen(hd)
+            layout = Layout(resolution=screen.resolution, layout=LAYOUT, mode=screen.mode)
+            layout.update_contents(UPDATE)
+            return screen, layout.concat()
+        def screen_write(state):
+            state[0].writeEPD(state[1])
+        cases[name] = (screen_setup, screen_write)
+
+    def screen_write_hd_rotated_setup(transformed):
+        screen = mock_screen(True)
+        screen.rotation = 90
+        screen.mirror = True
+        layout = Layout(resolution=screen.resolution, layout=LAYOUT, mode=screen.mode,
+                        transform=screen.transform if transformed else None)
+        layout.update_contents(UPDATE)
+        return screen, layout.concat(), transformed
+    def screen_write_hd_rotated(state):
+        state[0].writeEPD(state[1], transformed=state[2])
+    cases['screen_write_hd_rotate90_mirror'] = (lambda: screen_write_hd_rotated_setup(False), screen_write_hd_rotated)
+    cases['screen_write_hd_panel_orientation'] = (lambda: screen_write_hd_rotated_setup(True), screen_write_hd_rotated)
+
+    def screen_write_hd_partial_setup():
+        screen = mock_screen(True)
+        layout = Layout(resolution=screen.resolution, layout=LAYOUT, mode=screen.mode)
+        layout.update_contents(UPDATE)
+        screen.writeEPD(layout.concat())
+        screen.max_partials = 10**9
+        return [screen, layout, 0]
+    def screen_write_hd_partial(state):
+        state[2] += 1
+        state[1].update_contents({'footer_left': f'{state[2]}°C and sunny'})
+        state[0].writeEPD(state[1].concat(), partial=True)
+    cases['screen_write_hd_partial'] = (screen_write_hd_partial_setup, screen_write_hd_partial)
+
+    def screen_write_hd_tiles_setup():
+        screen = mock_screen(True)
+        screen.rotation = 90
+        screen.mirror = True
+        layout = Layout(resolution=screen.resolution, layout=LAYOUT, mode=screen.mode,
+                        transform=screen.transform)
+        layout.update_contents(UPDATE)
+        return screen, layout
+    def screen_write_hd_tiles(state):
+        state[0].write_tiles(state[1].tiles())
+    cases['screen_write_hd_tiles'] = (screen_write_hd_tiles_setup, screen_write_hd_tiles)
+
+    return cases
+
+
+def run(cases, repeat, number):
+    '''time each case `repeat` times running the function `number` times per repeat
+
+    Returns:
+        dict: {name: {min, median, mean, stdev, repeat, number}} times in seconds per call'''
+    results = {}
+    for name, (setup, function) in cases.items():
+        state = setup()
+        # warm up
+        function(state)
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for _ in range(number):
+                function(state)
+            times.append((time.perf_counter() - start)/number)
+        results[name] = {'min': min(times),
+                         'median': statistics.median(times),
+                         'mean': statistics.mean(times),
+                         'stdev': statistics.stdev(times) if len(times) > 1 else 0.0,
+                         'repeat': repeat,
+                         'number': number}
+        print(f'{name:<36} {results[name]["median"]*1000:10.3f} ms', file=sys.stderr)
+    return results
+
+
+def metadata():
+    '''describe the environment the benchmarks were run in'''
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'epdlib': version.__version__,
+            'commit': commit,
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+
+def compare(baseline, current, threshold):
+    '''print a comparison of two result sets
+
+    Returns:
+        list of names of benchmarks that are slower than the baseline by more than `threshold`'''
+    regressions = []
+    print(f'{"benchmark":<36} {"baseline ms":>12} {"current ms":>12} {"change":>8}')
+    for name, result in current['results'].items():
+        if name not in baseline['results']:
+            print(f'{name:<36} {"-":>12} {result["median"]*1000:12.3f}')
+            continue
+        old = baseline['results'][name]['median']
+        new = result['median']
+        change = (new - old)/old if old else 0.0
+        flag = ''
+        if change > threshold:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print(f'{name:<36} {old*1000:12.3f} {new*1000:12.3f} {change:+8.1%}{flag}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark epdlib Block, Layout and Screen hot paths')
+    parser.add_argument('-o', '--output', help='write results as JSON to this file')
+    parser.add_argument('-c', '--compare', help='JSON results file to compare against')
+    parser.add_argument('-t', '--threshold', type=float, default=0.1,
+                        help='fractional slow down that is reported as a regression (default: 0.1)')
+    parser.add_argument('-f', '--filter', action='append', default=[],
+                        help='only run benchmarks with names containing this string (repeatable)')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='number of timed repeats (default: 5)')
+    parser.add_argument('-n', '--number', type=int, default=3, help='calls per repeat (default: 3)')
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cases = benchmarks(tmp_dir)
+        if args.filter:
+            cases = {k: v for k, v in cases.items() if any(f in k for f in args.filter)}
+        results = {'meta': metadata(), 'results': run(cases, args.repeat, args.number)}
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, results, args.threshold)
+        if regressions:
+            print(f'\n{len(regressions)} regression(s): {", ".join(regressions)}')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
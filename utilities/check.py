@@ -0,0 +1,730 @@
+#!/usr/bin/env python3
+'''regression checks for the Block, Layout and Screen fast paths
+
+Each check compares a fast path with the slow path or driver it replaces using
+virtual panels, so no hardware is needed. Exits with status 1 if any check fails.
+
+Run all checks:
+    $ python utilities/check.py
+
+Run only some checks (substring match on the name):
+    $ python utilities/check.py --filter partial
+'''
+
+import argparse
+import asyncio
+import copy
+import json
+import logging
+import os
+import pickle
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from PIL import Image, ImageDraw
+
+from epdlib import Block, Layout, Pack, Screen, VirtualEPD, constants, register_driver
+from epdlib.Layout import LayoutError
+
+FONT = str(ROOT / 'fonts/Open_Sans/OpenSans-Regular.ttf')
+IMAGE = str(ROOT / 'images/portrait-pilot_SW0YN0Z5T0.jpg')
+
+# virtual panel with a slow refresh so frames queue up behind the background writer
+register_driver('check_slow_hd', VirtualEPD.loader(resolution=(400, 300), hd=True, full_refresh=.2))
+register_driver('check_hd', VirtualEPD.loader(resolution=(400, 300), hd=True))
+register_driver('check_virtual', VirtualEPD.loader(resolution=(400, 300), mode='1'))
+
+CHECKS = {}
+
+
+def check(f):
+    '''register a check; checks raise AssertionError on failure'''
+    CHECKS[f.__name__] = f
+    return f
+
+
+@check
+def partial_write_transformed_canvas():
+    '''partial writes of a Layout canvas rendered in panel orientation refresh the panel
+
+    `concat()` changes the same canvas in place, so the screen must not compare the
+    next frame with a reference to the canvas itself.'''
+    screen = Screen(epd='virtual_hd', rotation=90)
+    layout = Layout(resolution=screen.resolution, mode=screen.mode, transform=screen.transform,
+                    layout={'counter': {'type': 'TextBlock', 'width': 1, 'height': .3,
+                                        'abs_coordinates': (0, 0), 'font': FONT, 'max_lines': 1}})
+    for i in range(4):
+        layout.update_contents({'counter': f'frame {i}'})
+        image = layout.concat()
+        screen.writeEPD(image, partial=True, transformed=True)
+        assert len(screen.epd.refreshes) == i + 1, f'frame {i} was not refreshed'
+        assert screen.epd.image.tobytes() == image.tobytes(), f'panel does not match frame {i}'
+
+
+@check
+def diff_boxes_regions():
+    '''`diff_boxes` finds no regions in identical frames and one box per separate change'''
+    old = Image.new('L', (400, 300), 255)
+    assert Screen.diff_boxes(old, old.copy()) == [], 'identical frames differ'
+
+    new = old.copy()
+    new.putpixel((123, 45), 0)
+    assert Screen.diff_boxes(old, new) == [(123, 45, 124, 46)], Screen.diff_boxes(old, new)
+
+    # changes in strips that are not adjacent are separate boxes
+    new.paste(0, (300, 200, 320, 210))
+    assert Screen.diff_boxes(old, new, strip=16) == [(123, 45, 124, 46), (300, 200, 320, 210)], \
+        Screen.diff_boxes(old, new, strip=16)
+    assert Screen.diff_boxes(old.convert('1'), new.convert('1'), strip=16) == Screen.diff_boxes(old, new, strip=16)
+
+
+@check
+def partial_write_promotion():
+    '''partial writes become full refreshes above `partial_threshold` and after `max_partials`'''
+    du, gc16 = constants.VIRTUAL_HD_DISPLAY_MODES['DU'], constants.VIRTUAL_HD_DISPLAY_MODES['GC16']
+    screen = Screen(epd='check_hd', rotation=0, partial_threshold=.25, max_partials=2)
+    frame = Image.new('L', screen.resolution, 255)
+
+    def write(box):
+        frame.paste(0 if frame.getpixel(box[:2]) else 255, box)
+        screen.epd.refreshes.clear()
+        screen.writeEPD(frame, partial=True)
+        return [mode for mode, seconds in screen.epd.refreshes]
+
+    assert write((0, 0, 10, 10)) == [gc16], 'first frame was not a full refresh'
+    assert write((0, 0, 10, 10)) == [du], 'small change was not a partial refresh'
+    assert write((0, 0, 400, 100)) == [gc16], 'change above partial_threshold was not a full refresh'
+    assert screen.partial_count == 0
+    assert write((0, 0, 10, 10)) == [du] and write((0, 0, 10, 10)) == [du]
+    assert write((0, 0, 10, 10)) == [gc16], 'max_partials was not followed by a full refresh'
+    assert screen.epd.image.tobytes() == frame.tobytes(), 'panel does not match the frame'
+
+
+class UpdateModeEPD(VirtualEPD.VirtualEPD):
+    '''drivers that take the refresh mode as an argument to `init()` (e.g. epd2in13_V2)'''
+    FULL_UPDATE = 0
+    PART_UPDATE = 1
+
+    def init(self, update):
+        self.awake = True
+        self.inits.append({self.FULL_UPDATE: 'full', self.PART_UPDATE: 'partial'}[update])
+        return 0
+
+    @property
+    def init_part(self):
+        raise AttributeError('init_part')
+
+
+@check
+def partial_write_init_mode():
+    '''non HD panels are initialized for a partial refresh only before `displayPartial()`'''
+    register_driver('check_update_mode', lambda screen, epd: {
+        'epd': UpdateModeEPD(resolution=(400, 300)), 'resolution': [400, 300], 'clear_args': {},
+        'one_bit_display': True, 'constants': None, 'mode': '1'})
+    for driver in ('check_virtual', 'check_update_mode'):
+        screen = Screen(epd=driver, rotation=0, max_partials=1)
+        frame = Image.new('1', screen.resolution, 1)
+        for i in range(3):
+            frame.putpixel((i, i), 0)
+            screen.writeEPD(frame, partial=True)
+        assert screen.epd.inits == ['full', 'partial', 'full'], f'{driver}: {screen.epd.inits}'
+        assert [waveform for waveform, seconds in screen.epd.refreshes] == ['full', 'partial', 'full'], \
+            f'{driver}: {screen.epd.refreshes}'
+        assert screen.epd.image.tobytes() == frame.tobytes(), f'{driver}: panel does not match the frame'
+
+
+@check
+def concat_changed_boxes():
+    '''`concat` pastes only changed blocks and blocks that overlap them'''
+    layout = Layout(resolution=(400, 300), mode='L', layout={
+        'a': {'type': 'TextBlock', 'width': .5, 'height': .5, 'abs_coordinates': (0, 0), 'font': FONT},
+        'b': {'type': 'TextBlock', 'width': .5, 'height': .5, 'abs_coordinates': (200, 0), 'font': FONT},
+        'c': {'type': 'TextBlock', 'width': 1, 'height': .5, 'abs_coordinates': (0, 150), 'font': FONT}})
+    layout.update_contents({'a': 'spam', 'b': 'eggs', 'c': 'ham'})
+    layout.concat()
+    assert layout.changed_boxes == [(0, 0, 400, 300)], 'first concat was not full'
+
+    layout.update_contents({'a': 'spam', 'b': 'bacon', 'c': 'ham'})
+    image = layout.concat()
+    assert layout.changed_boxes == [(200, 0, 400, 150)], layout.changed_boxes
+    assert image.tobytes() == layout.concat(full=True).tobytes(), 'canvas differs from a full concat'
+    layout.concat()
+    assert layout.changed_boxes == [], 'unchanged blocks were pasted'
+
+
+@check
+def layout_copy_and_pickle():
+    '''layouts can be deep copied and pickled; copies of sections are plain dicts'''
+    layout = Layout(resolution=(400, 300), mode='L', layout={
+        'title': {'type': 'TextBlock', 'width': 1, 'height': .5, 'abs_coordinates': (0, 0),
+                  'font': FONT, 'max_lines': 1},
+        'body': {'type': 'TextBlock', 'width': 1, 'height': .5, 'abs_coordinates': (0, None),
+                 'relative': ['body', 'title'], 'font': FONT, 'max_lines': 2}})
+    layout.update_contents({'title': 'spam', 'body': 'eggs'})
+    for section in (copy.copy(layout.layout['body']), copy.deepcopy(layout.layout)['body']):
+        assert type(section) is dict, f'section copy is a {type(section)}'
+        assert section['relative'] == ['body', 'title'] and 'area' in section
+
+    expected = layout.concat().tobytes()
+    for other in (copy.deepcopy(layout), pickle.loads(pickle.dumps(layout))):
+        assert other.concat().tobytes() == expected, 'copy renders differently'
+        other.update_block_props('title', {'height': .25}, force_recalc=True)
+        other.update_contents({'title': 'ham', 'body': 'eggs'})
+        assert other.blocks['body'].abs_coordinates == (0, 75), 'copy did not recalculate'
+    assert layout.concat().tobytes() == expected, 'changing a copy changed the original'
+
+
+@check
+def layout_incremental_relayout():
+    '''relayout rebuilds only dependent blocks, follows forward references and rejects cycles'''
+    # `body` is positioned relative to `header`, which follows it in the layout
+    layout = Layout(resolution=(400, 300), mode='L', layout={
+        'body': {'type': 'TextBlock', 'width': 1, 'height': .5, 'abs_coordinates': (0, None),
+                 'relative': ['body', 'header'], 'font': FONT, 'max_lines': 2},
+        'header': {'type': 'TextBlock', 'width': 1, 'height': .25, 'abs_coordinates': (0, 0),
+                   'font': FONT, 'max_lines': 1},
+        'footer': {'type': 'TextBlock', 'width': 1, 'height': .25, 'abs_coordinates': (0, 225),
+                   'font': FONT, 'max_lines': 1}})
+    layout.update_contents({'body': 'spam', 'header': 'eggs', 'footer': 'ham'})
+    assert layout.blocks['body'].abs_coordinates == (0, 75), 'forward reference was not resolved'
+
+    footer = layout.blocks['footer']
+    changed = layout.update_block_props('header', {'height': .5}, force_recalc=True)
+    assert sorted(changed) == ['body', 'header'], f'rebuilt {changed}'
+    assert layout.blocks['footer'] is footer, 'an independent block was rebuilt'
+    assert layout.blocks['body'].abs_coordinates == (0, 150), 'dependent block was not moved'
+
+    master = dict(layout._master_layout)
+    try:
+        layout.update_block_props('header', {'abs_coordinates': (0, None), 'relative': ['header', 'body']})
+    except LayoutError as e:
+        assert 'header -> body -> header' in str(e) or 'body -> header -> body' in str(e), str(e)
+    else:
+        raise AssertionError('cycle was accepted')
+    assert layout._master_layout == master, 'rejected properties were stored'
+    assert layout.layout['header']['relative'] is False, 'rejected properties were applied'
+    layout.resolution = (200, 200)
+    assert layout.blocks['body'].abs_coordinates == (0, 100), 'layout could not be recalculated'
+
+
+@check
+def layout_sections_are_dicts():
+    '''layout sections are plain dicts; nested values are copied from the caller'''
+    relative = ['body', 'title']
+    spec = {'title': {'type': 'TextBlock', 'width': 1, 'height': .5, 'abs_coordinates': (0, 0),
+                      'font': FONT, 'max_lines': 1},
+            'body': {'type': 'TextBlock', 'width': 1, 'height': .5, 'abs_coordinates': (0, None),
+                     'relative': relative, 'font': FONT, 'max_lines': 2}}
+    layout = Layout(resolution=(400, 300), mode='L', layout=spec)
+    assert all(type(section) is dict for section in layout.layout.values()), 'sections are not dicts'
+    assert json.loads(json.dumps(layout.layout))['body']['area'] == [400, 150], 'layout is not JSON'
+
+    relative[1] = 'body'
+    layout.resolution = (200, 200)
+    assert layout.layout['body']['relative'] == ['body', 'title'], 'nested value shared with the caller'
+    assert layout.blocks['body'].abs_coordinates == (0, 100), 'relayout used the changed value'
+
+    layout.layout['body']['max_lines'] = 3
+    assert layout.layout['body']['max_lines'] == 3, 'section could not be changed in place'
+
+
+@check
+def unchanged_blocks_skip_render():
+    '''blocks are not rendered again for unchanged contents; `rand` blocks always are'''
+    layout = Layout(resolution=(400, 300), mode='L', layout={
+        'title': {'type': 'TextBlock', 'width': 1, 'height': .25, 'abs_coordinates': (0, 0), 'font': FONT},
+        'photo': {'type': 'ImageBlock', 'width': .5, 'height': .75, 'abs_coordinates': (0, 75)},
+        'shuffle': {'type': 'TextBlock', 'width': .5, 'height': .75, 'abs_coordinates': (200, 75),
+                    'font': FONT, 'rand': True}})
+    update = {'title': 'spam', 'photo': IMAGE, 'shuffle': 'eggs'}
+    assert layout.update_contents(update) == ['title', 'photo', 'shuffle']
+    assert layout.update_contents(update) == ['shuffle'], 'unchanged blocks were rendered'
+    assert layout.update_contents(dict(update, title='ham')) == ['title', 'shuffle']
+
+    # images with the same pixel data are unchanged contents
+    assert layout.update_contents({'photo': Image.open(IMAGE)}) == ['photo']
+    assert layout.update_contents({'photo': Image.open(IMAGE)}) == [], 'identical image was rendered'
+
+    # changing a property renders the block again for the same contents
+    layout.blocks['title'].fill = 128
+    assert layout.update_contents({'title': 'ham'}) == ['title'], 'changed block was not rendered'
+
+
+@check
+def shared_geometry_records():
+    '''blocks share the read-only Geometry record calculated by the layout'''
+    layout = Layout(resolution=(400, 300), mode='L', layout={
+        'title': {'type': 'TextBlock', 'width': 1, 'height': .5, 'abs_coordinates': (0, 0),
+                  'font': FONT, 'padding': 4},
+        'body': {'type': 'DrawBlock', 'width': 1, 'height': .5, 'abs_coordinates': (0, None),
+                 'relative': ['body', 'title'], 'shape': 'rectangle'}})
+    for name, block in layout.blocks.items():
+        assert block.geometry is layout.geometry[name], f'{name} does not share the layout record'
+    geometry = layout.geometry['title']
+    assert geometry.box == (0, 0, 400, 150) and geometry.padded_area == (392, 142), geometry
+    assert not hasattr(geometry, '__dict__'), 'Geometry records are not slotted'
+    try:
+        geometry.area = (1, 1)
+    except AttributeError:
+        pass
+    else:
+        raise AssertionError('Geometry record was changed')
+
+    # a block built from a record makes no records of its own
+    made = []
+    init = Block.Geometry.__init__
+    Block.Geometry.__init__ = lambda self, *args, **kwargs: made.append(args) or init(self, *args, **kwargs)
+    try:
+        block = Block.DrawBlock(area=(1, 1), geometry=geometry, shape='ellipse')
+    finally:
+        Block.Geometry.__init__ = init
+    assert made == [] and block.geometry is geometry, f'{len(made)} records were made'
+
+    # changing a block replaces its record; the layout record is unchanged
+    block.area = (200, 100)
+    assert block.geometry.area == (200, 100) and geometry.area == (400, 150)
+    assert block.geometry.abs_coordinates == geometry.abs_coordinates
+
+
+TEXTS = ['Partly cloudy with a chance of showers in the afternoon, high of 18',
+         'AVATAR WAVE To Wednesday', 'supercalifragilisticexpialidocious is a long word', 'x']
+
+
+@check
+def text_fitting():
+    '''measured lines fit the width and auto_shrink picks the largest font size that fits'''
+    for text in TEXTS:
+        for size, width in ((12, 60), (20, 150), (33, 300)):
+            face = Block.get_font(FONT, size)
+            lines = Block.measured_lines(text, FONT, size, width, max_lines=3)
+            assert 0 < len(lines) <= 3, lines
+            assert all(face.getlength(line) <= width for line in lines), f'{lines} wider than {width}'
+
+        area = (300, 120)
+        best = Block.fit_font_size(text, FONT, 80, area, max_lines=3)
+        lines = Block.measured_lines(text, FONT, best, area[0], max_lines=3)
+        assert Block._lines_height(Block.get_font(FONT, best), lines) <= area[1], f'{text!r} at {best}'
+        if best < 80:
+            larger = Block.measured_lines(text, FONT, best + 1, area[0], max_lines=3, placeholder='')
+            assert (' '.join(larger).split() != text.split()
+                    or Block._lines_height(Block.get_font(FONT, best + 1), larger) > area[1]), \
+                f'{text!r} also fits at {best + 1}'
+
+        block = Block.TextBlock(area=area, font=FONT, font_size=80, max_lines=3, text=text, auto_shrink=True)
+        assert block.text_font.size == best, f'auto_shrink used {block.text_font.size}, expected {best}'
+        assert block.text_formatted.split() == text.split(), 'auto_shrink truncated the text'
+
+
+@check
+def text_caches():
+    '''text blocks render the same from the shared wrapped text and text image caches'''
+    import textwrap
+    messages = [f'message number {i} with some words to wrap around' for i in range(4)]
+    blocks = [Block.TextBlock(area=(300, 100), font=FONT, font_size=20, max_lines=3, mode='L'),
+              Block.TextBlock(area=(300, 100), font=FONT, font_size=20, max_lines=3, mode='L', inverse=True,
+                              border_config={'fill': 0, 'width': 3}),
+              Block.TextBlock(area=(300, 100), font=FONT, font_size=20, max_lines=3, mode='RGB', fill='RED')]
+
+    def render():
+        images = {}
+        for i, block in enumerate(blocks):
+            for message in messages:
+                block.update(message)
+                assert block.text_formatted == textwrap.fill(message, width=block.maxchar, max_lines=3,
+                                                             placeholder='…')
+                images[i, message] = block.image.tobytes()
+        return images
+
+    Block.clear_font_cache()
+    uncached = render()
+    hits = Block.text_cache_info()['image'].hits
+    assert render() == uncached, 'cached text renders differently'
+    assert Block.text_cache_info()['image'].hits >= hits + len(uncached), Block.text_cache_info()
+    assert uncached[0, messages[0]] != uncached[1, messages[0]], 'blocks with different colors share images'
+
+
+@check
+def tiles_match_concat():
+    '''`tiles()` composes the same pixels as `concat()` under every transform and tile height'''
+    T = Image.Transpose
+    spec = {'title': {'type': 'TextBlock', 'width': 1, 'height': .3, 'abs_coordinates': (0, 0),
+                      'font': FONT, 'max_lines': 2, 'padding': 5},
+            'photo': {'type': 'ImageBlock', 'width': .6, 'height': .7, 'abs_coordinates': (0, None),
+                      'relative': ['photo', 'title']},
+            'box': {'type': 'DrawBlock', 'width': .4, 'height': .7, 'abs_coordinates': (None, None),
+                    'relative': ['photo', 'title'], 'shape': 'ellipse', 'fill': 0}}
+    for transform in (None, T.ROTATE_90, T.ROTATE_180, T.ROTATE_270, T.FLIP_LEFT_RIGHT,
+                      T.FLIP_TOP_BOTTOM, T.TRANSPOSE, T.TRANSVERSE):
+        layout = Layout(resolution=(300, 200), mode='L', transform=transform, layout=spec)
+        layout.update_contents({'title': 'spam and eggs', 'photo': IMAGE, 'box': True})
+        expected = layout.concat(full=True).tobytes()
+        for tile_height in (1, 64, 77, 1000):
+            canvas = Image.new(layout.image.mode, layout.image.size, 'white')
+            for box, tile in layout.tiles(tile_height):
+                canvas.paste(tile, box[:2])
+            assert canvas.tobytes() == expected, f'{transform} tile height {tile_height} differs'
+
+
+@check
+def executors_match_serial():
+    '''thread and process executors render the same images as serial rendering; text blocks
+    are rendered in the calling thread'''
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+    import threading
+
+    spec = {'title': {'type': 'TextBlock', 'width': 1, 'height': .25, 'abs_coordinates': (0, 0),
+                      'font': FONT, 'rand': True},
+            'photo': {'type': 'ImageBlock', 'width': .5, 'height': .75, 'abs_coordinates': (0, 150),
+                      'rand': True, 'padding': 10},
+            'logo': {'type': 'ImageBlock', 'width': .5, 'height': .75, 'abs_coordinates': (300, 150),
+                     'hcenter': True, 'vcenter': True},
+            'box': {'type': 'DrawBlock', 'width': .25, 'height': .25, 'abs_coordinates': (450, 0),
+                    'shape': 'rounded_rectangle', 'fill': 0}}
+    logo = Image.new('L', (100, 100), 128)
+
+    def render(executor):
+        layout = Layout(resolution=(600, 600), mode='L', layout=spec, executor=executor, seed=7)
+        threads = set()
+        update = layout.blocks['title'].update
+        layout.blocks['title'].update = lambda *args: threads.add(threading.get_ident()) or update(*args)
+        images = []
+        for i in range(3):
+            layout.update_contents({'title': f'spam {i}', 'photo': IMAGE, 'logo': logo, 'box': True})
+            images.append(layout.concat().tobytes())
+        assert threads == {threading.get_ident()}, 'text was rendered in a worker thread'
+        return images
+
+    expected = render(None)
+    with ThreadPoolExecutor(4) as executor:
+        assert render(executor) == expected, 'thread executor renders differently'
+    with ProcessPoolExecutor(2) as executor:
+        assert render(executor) == expected, 'process executor renders differently'
+
+
+# prints whether trusted mode is on and whether a wrong type was rejected by a setter
+TRUSTED_MODE = '''
+from epdlib import Block, Validate
+try:
+    Block.Block(area=(10, 10)).hcenter = 'yes'
+except TypeError:
+    print(Validate.TRUSTED, 'checked')
+else:
+    print(Validate.TRUSTED, 'unchecked')
+'''
+
+
+@check
+def trusted_mode_opt_in():
+    '''type checks are removed only when EPDLIB_TRUSTED is set, not by `python -O`'''
+    env = {key: val for key, val in os.environ.items() if key != 'EPDLIB_TRUSTED'}
+    for flags, trusted, expected in (([], None, 'False checked'), (['-O'], None, 'False checked'),
+                                     ([], '0', 'False checked'), ([], '1', 'True unchecked')):
+        run_env = env if trusted is None else dict(env, EPDLIB_TRUSTED=trusted)
+        result = subprocess.run([sys.executable, *flags, '-c', TRUSTED_MODE], cwd=ROOT, env=run_env,
+                                check=True, capture_output=True, text=True).stdout.strip()
+        assert result == expected, f'{flags} EPDLIB_TRUSTED={trusted}: {result}'
+
+
+# layout with image blocks and an object whose repr includes its memory address; prints
+# the cache file name, the number of fonts scaled and the font size
+CACHE_LAYOUT = f'''
+import sys
+from PIL import Image
+from epdlib import Layout
+class Icon: pass
+scaled = []
+scale_font = Layout._scale_font
+Layout._scale_font = staticmethod(lambda section: scaled.append(section) or scale_font(section))
+layout = Layout(resolution=(400, 300), mode='L', cache_dir=sys.argv[1], layout={{
+    'title': {{'type': 'TextBlock', 'width': 1, 'height': .5, 'abs_coordinates': (0, 0), 'font': {FONT!r},
+               'max_lines': 1, 'image': Image.new('L', (20, 20), 3), 'icon': Icon()}},
+    'photo': {{'type': 'ImageBlock', 'width': .5, 'height': .5, 'abs_coordinates': (0, 150),
+               'image': Image.open({IMAGE!r})}},
+    'logo': {{'type': 'ImageBlock', 'width': .5, 'height': .5, 'abs_coordinates': (200, 150),
+              'image': Image.new('L', (20, 20), 3)}}}})
+print(layout._cache_file().name, len(scaled), layout.layout['title']['font_size'])
+'''
+
+
+@check
+def layout_cache_key_and_pruning():
+    '''layout cache files are found again by a new process and stale files are removed'''
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache_dir = Path(cache_dir)
+        for i in range(constants.LAYOUT_CACHE_FILES + 4):
+            stale = cache_dir / f'layout_{i:040x}.json'
+            stale.write_text('{}')
+            os.utime(stale, (i, i))
+        runs = [subprocess.run([sys.executable, '-c', CACHE_LAYOUT, str(cache_dir)], cwd=ROOT, check=True,
+                               capture_output=True, text=True).stdout.split() for _ in range(2)]
+        (cold_name, cold_scaled, cold_size), (warm_name, warm_scaled, warm_size) = runs
+        assert cold_name == warm_name, f'cache key changed between processes: {runs}'
+        assert cold_scaled == '1' and warm_scaled == '0', f'warm start did not use the cache: {runs}'
+        assert cold_size == warm_size, f'cached font size differs: {runs}'
+        names = [cold_name]
+        files = list(cache_dir.glob('layout_*.json'))
+        assert len(files) == constants.LAYOUT_CACHE_FILES, f'{len(files)} cache files kept'
+        assert cache_dir / names[0] in files, 'the current cache file was removed'
+
+
+# waveshare_epd modules: `epd_stub` does not define EPD_WIDTH and EPD_HEIGHT
+STUB_DRIVER = '''
+class EPD:
+    def Clear(self, color=0xFF): pass
+    def display(self, image): pass
+'''
+PROBE_STUB = '''
+import sys
+from pathlib import Path
+sys.path.insert(0, sys.argv[1])
+from epdlib import Screen, list_compatible_modules
+from epdlib.Screen import ScreenError, constants, panel_capabilities
+constants.PANEL_INDEX_FILE = Path(sys.argv[1]) / 'panels.json'
+assert panel_capabilities('epd_stub')['resolution'] is None
+assert panel_capabilities('epd_sized')['resolution'] == [250, 122]
+try:
+    Screen(epd='epd_stub')
+except ScreenError as e:
+    assert 'epd_stub' in str(e), str(e)
+else:
+    raise AssertionError('panel without a resolution was loaded')
+panels = {i['name']: i for i in list_compatible_modules(print_modules=False)}
+assert not panels['epd_stub']['supported'] and panels['epd_sized']['supported'], panels
+'''
+
+
+@check
+def panel_without_resolution():
+    '''waveshare modules without EPD_WIDTH and EPD_HEIGHT are refused with a ScreenError'''
+    with tempfile.TemporaryDirectory() as tmp:
+        package = Path(tmp) / 'waveshare_epd'
+        package.mkdir()
+        (package / '__init__.py').write_text('')
+        (package / 'epd_stub.py').write_text(STUB_DRIVER)
+        (package / 'epd_sized.py').write_text('EPD_WIDTH = 122\nEPD_HEIGHT = 250\n' + STUB_DRIVER)
+        result = subprocess.run([sys.executable, '-c', PROBE_STUB, tmp],
+                                capture_output=True, text=True, cwd=ROOT)
+        assert result.returncode == 0, result.stderr
+
+
+def _slow_screen():
+    '''return a screen whose background writer is busy writing a frame'''
+    screen = Screen(epd='check_slow_hd', rotation=0)
+    screen.write_background(Image.new('L', screen.resolution, 0))
+    # wait for the writer thread to take the first frame
+    while screen._pending:
+        time.sleep(.001)
+    return screen
+
+
+@check
+def background_writer_cancelled_frame():
+    '''a cancelled pending frame does not break replacing or dropping frames'''
+    screen = _slow_screen()
+    pending = screen.write_background(Image.new('L', screen.resolution, 128))
+    assert pending.cancel(), 'pending frame could not be cancelled'
+    newer = screen.write_background(Image.new('L', screen.resolution, 255))
+    assert newer.result(timeout=5) is True, 'newer frame was not written'
+
+    pending = screen.write_background(Image.new('L', screen.resolution, 0))
+    pending.cancel()
+    assert screen.stop_writer(wait=False, timeout=5), 'writer did not stop'
+
+
+@check
+def write_async_timeout():
+    '''frames queued after `asyncio.wait_for()` cancelled a waiting frame are written'''
+    screen = _slow_screen()
+
+    async def main():
+        try:
+            await asyncio.wait_for(screen.write_async(Image.new('L', screen.resolution, 128)), .01)
+        except asyncio.TimeoutError:
+            pass
+        return await screen.write_async(Image.new('L', screen.resolution, 255))
+
+    assert asyncio.run(main()) is True, 'frame after timeout was not written'
+    screen.stop_writer()
+    assert screen.epd.image.getextrema() == (255, 255), 'panel does not show the last frame'
+
+
+# replicas of the getbuffer() implementations in the waveshare_epd drivers
+class LoopEPD(VirtualEPD.VirtualEPD):
+    '''older 1 bit drivers (e.g. epd2in13_V2): convert, then per pixel loops; padding bits set'''
+    def getbuffer(self, image):
+        if self.width%8 == 0:
+            linewidth = int(self.width/8)
+        else:
+            linewidth = int(self.width/8) + 1
+        buf = [0xFF] * (linewidth * self.height)
+        image_monocolor = image.convert('1')
+        imwidth, imheight = image_monocolor.size
+        pixels = image_monocolor.load()
+        if(imwidth == self.width and imheight == self.height):
+            for y in range(imheight):
+                for x in range(imwidth):
+                    if pixels[x, y] == 0:
+                        buf[int(x / 8) + y * linewidth] &= ~(0x80 >> (x % 8))
+        elif(imwidth == self.height and imheight == self.width):
+            for y in range(imheight):
+                for x in range(imwidth):
+                    newx = y
+                    newy = self.height - x - 1
+                    if pixels[x, y] == 0:
+                        buf[int(newx / 8) + newy*linewidth] &= ~(0x80 >> (y % 8))
+        return buf
+
+
+class TobytesEPD(VirtualEPD.VirtualEPD):
+    '''newer 1 bit drivers (e.g. epd7in5_V2): rotate, then convert'''
+    def getbuffer(self, image):
+        img = image
+        imwidth, imheight = img.size
+        if(imwidth == self.width and imheight == self.height):
+            img = img.convert('1')
+        elif(imwidth == self.height and imheight == self.width):
+            img = img.rotate(90, expand=True).convert('1')
+        else:
+            return [0x00] * (int(self.width/8) * self.height)
+        return bytearray(img.tobytes('raw'))
+
+
+class SevenColorEPD(VirtualEPD.VirtualEPD):
+    '''7 color drivers (e.g. epd5in65f)'''
+    def getbuffer(self, image):
+        pal_image = Image.new("P", (1,1))
+        pal_image.putpalette((0,0,0,  255,255,255,  0,255,0,   0,0,255,  255,0,0,  255,255,0, 255,128,0) + (0,0,0)*249)
+        imwidth, imheight = image.size
+        if(imwidth == self.width and imheight == self.height):
+            image_temp = image
+        elif(imwidth == self.height and imheight == self.width):
+            image_temp = image.rotate(90, expand=True)
+        image_7color = image_temp.convert("RGB").quantize(palette=pal_image)
+        buf_7color = bytearray(image_7color.tobytes('raw'))
+        buf = [0x00] * int(self.width * self.height / 2)
+        idx = 0
+        for i in range(0, len(buf_7color), 2):
+            buf[idx] = (buf_7color[i] << 4) + buf_7color[i+1]
+            idx += 1
+        return buf
+
+
+class FourColorEPD(VirtualEPD.VirtualEPD):
+    '''4 color drivers (e.g. epd7in3g)'''
+    def getbuffer(self, image):
+        pal_image = Image.new("P", (1,1))
+        pal_image.putpalette((0,0,0,  255,255,255,  255,255,0,   255,0,0) + (0,0,0)*252)
+        imwidth, imheight = image.size
+        if(imwidth == self.width and imheight == self.height):
+            image_temp = image
+        elif(imwidth == self.height and imheight == self.width):
+            image_temp = image.rotate(90, expand=True)
+        image_4color = image_temp.convert("RGB").quantize(palette=pal_image)
+        buf_4color = bytearray(image_4color.tobytes('raw'))
+        buf = [0x00] * int(self.width * self.height / 4)
+        idx = 0
+        for i in range(0, len(buf_4color), 4):
+            buf[idx] = (buf_4color[i] << 6) + (buf_4color[i+1] << 4) + (buf_4color[i+2] << 2) + buf_4color[i+3]
+            idx += 1
+        return buf
+
+
+class InvertedEPD(TobytesEPD):
+    '''drivers that invert the bits (e.g. later epd7in5_V2); no packed format matches'''
+    def getbuffer(self, image):
+        buf = super().getbuffer(image)
+        for i in range(len(buf)):
+            buf[i] ^= 0xFF
+        return buf
+
+
+REPLICAS = [(LoopEPD, (122, 250), '1'), (LoopEPD, (400, 300), '1'), (TobytesEPD, (800, 480), '1'),
+            (TobytesEPD, (122, 250), '1'), (InvertedEPD, (800, 480), '1'),
+            (SevenColorEPD, (600, 448), 'RGB'), (FourColorEPD, (800, 480), 'RGB')]
+# the Pack format that reproduces each replica driver
+REPLICA_FORMATS = {(LoopEPD, 122): '1bpp', (LoopEPD, 400): '1bpp', (TobytesEPD, 800): '1bpp_rotate_first',
+                   (TobytesEPD, 122): '1bpp_rotate_first_pad0', (SevenColorEPD, 600): '4bpp_7color',
+                   (FourColorEPD, 800): '2bpp_4color'}
+
+
+def _frames(size):
+    '''black and white drawings first, then photos and noise'''
+    drawing = Image.new('L', size, 255)
+    draw = ImageDraw.Draw(drawing)
+    draw.rectangle((5, 5, size[0]//2, size[1]//3), fill=0)
+    draw.text((10, size[1]//2), 'spam & eggs', fill=0)
+    photo = Image.open(IMAGE).resize(size)
+    return [Image.new('L', size, 255), drawing, drawing.convert('1'), drawing.convert('RGB'),
+            photo.convert('L'), photo.convert('RGB'), Image.effect_noise(size, 80).convert('RGB'),
+            drawing, photo.convert('L').transpose(Image.Transpose.FLIP_LEFT_RIGHT)]
+
+
+@check
+def pack_formats_match_drivers():
+    '''`Pack.pack()` reproduces the buffer of each replica driver byte for byte in both orientations'''
+    for (cls, width), fmt in REPLICA_FORMATS.items():
+        height, mode = next((size[1], mode) for c, size, mode in REPLICAS if (c, size[0]) == (cls, width))
+        epd = cls(resolution=(width, height), mode=mode)
+        for size in ((width, height), (height, width)):
+            for i, frame in enumerate(_frames(size)):
+                assert bytes(Pack.pack(frame, width, height, fmt)) == bytes(epd.getbuffer(frame)), \
+                    f'{fmt} differs from {cls.__name__} {width}x{height}: frame {i} ({frame.mode} {size})'
+
+
+@check
+def packed_buffers_match_drivers():
+    '''every buffer packed by epdlib equals the buffer packed by the driver byte for byte
+
+    Frames in both orientations start with pure black and white images that match
+    several formats.'''
+    for cls, (width, height), mode in REPLICAS:
+        def load(screen, epd, cls=cls, width=width, height=height, mode=mode):
+            return {'epd': cls(resolution=(width, height), mode=mode), 'resolution': sorted((width, height), reverse=True),
+                    'clear_args': {}, 'one_bit_display': mode == '1', 'constants': None, 'mode': mode}
+        register_driver('check_replica', load)
+        screen = Screen(epd='check_replica', rotation=0)
+        for size in ((width, height), (height, width)):
+            for i, frame in enumerate(_frames(size)):
+                expected = bytes(screen.epd.getbuffer(frame))
+                assert bytes(screen._getbuffer(frame)) == expected, \
+                    f'{cls.__name__} {width}x{height}: frame {i} ({frame.mode} {size}) differs from the driver buffer'
+        # formats are used for the drivers that epdlib can pack
+        if cls is not InvertedEPD:
+            assert any(isinstance(fmt, str) for fmt in screen._buffer_formats.values()), \
+                f'{cls.__name__} {width}x{height}: no packed format was used: {screen._buffer_formats}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='regression checks for epdlib fast paths')
+    parser.add_argument('-f', '--filter', action='append', default=[],
+                        help='only run checks with names containing this string (repeatable)')
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+
+    failed = []
+    for name, f in CHECKS.items():
+        if args.filter and not any(s in name for s in args.filter):
+            continue
+        try:
+            f()
+        except Exception:
+            failed.append(name)
+            print(f'{name:<48} FAIL\n{traceback.format_exc()}')
+        else:
+            print(f'{name:<48} ok')
+
+    if failed:
+        print(f'\n{len(failed)} check(s) failed: {", ".join(failed)}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()